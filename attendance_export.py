@@ -0,0 +1,128 @@
+import csv
+import json
+from datetime import datetime, time
+
+# Attendance export for payroll: worked hours per person and per role from a stream of attendance
+# rows ({"id", "user_id", "user_type", "date", "check_in", "check_out"}, as face_lock.fetch_attendance_rows
+# yields them). Rows are consumed one at a time; only one running total per person is kept.
+
+ROW_FIELDS = ("date", "user_id", "name", "user_type", "check_in", "check_out", "hours")
+USER_FIELDS = ("user_id", "name", "user_type", "days", "complete_days", "open_days", "hours", "first_date", "last_date")
+ROLE_FIELDS = ("user_type", "people", "days", "complete_days", "open_days", "hours")
+
+
+def parse_timestamp(value, day):
+    """datetime of a check-in/out value: an ISO timestamp, or a bare time of day on `day`."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        pass
+    try:
+        return datetime.combine(datetime.fromisoformat(day).date(), time.fromisoformat(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def worked_hours(row):
+    """Hours between check-in and check-out, or None while checked in (or if the pair is unusable)."""
+    start = parse_timestamp(row.get("check_in"), row.get("date"))
+    end = parse_timestamp(row.get("check_out"), row.get("date"))
+    if start is None or end is None:
+        return None
+    if (start.tzinfo is None) != (end.tzinfo is None):
+        start, end = start.replace(tzinfo=None), end.replace(tzinfo=None)
+    hours = (end - start).total_seconds() / 3600
+    return hours if hours >= 0 else None
+
+
+class HoursSummary:
+    """Running totals per (user_id, user_type). people maps uuid -> {"name", "type"} (id_map.json) and
+    fills in names, and the role when the attendance table has no user_type column."""
+
+    def __init__(self, people=None):
+        self.people = people or {}
+        self.totals = {}  # (user_id, user_type) -> [days, complete_days, hours, first_date, last_date]
+
+    def person(self, row):
+        known = self.people.get(row.get("user_id")) or {}
+        return known.get("name", "Unknown"), row.get("user_type") or known.get("type") or "unknown"
+
+    def add(self, row):
+        """Counts one attendance row. Returns the row with name, user_type and hours filled in."""
+        name, user_type = self.person(row)
+        hours = worked_hours(row)
+        key = (row.get("user_id"), user_type)
+        total = self.totals.get(key)
+        if total is None:
+            total = self.totals[key] = [0, 0, 0.0, row.get("date"), row.get("date")]
+        total[0] += 1
+        if hours is not None:
+            total[1] += 1
+            total[2] += hours
+        day = row.get("date")
+        if day and (total[3] is None or day < total[3]):
+            total[3] = day
+        if day and (total[4] is None or day > total[4]):
+            total[4] = day
+        return dict(row, name=name, user_type=user_type, hours=None if hours is None else round(hours, 2))
+
+    def users(self):
+        """One record per person, by role and name."""
+        records = []
+        for (user_id, user_type), (days, complete, hours, first, last) in self.totals.items():
+            name = (self.people.get(user_id) or {}).get("name", "Unknown")
+            records.append({"user_id": user_id, "name": name, "user_type": user_type, "days": days,
+                            "complete_days": complete, "open_days": days - complete, "hours": round(hours, 2),
+                            "first_date": first, "last_date": last})
+        return sorted(records, key=lambda r: (r["user_type"], r["name"], r["user_id"] or ""))
+
+    def roles(self):
+        """Totals per role."""
+        roles = {}
+        for (_, user_type), (days, complete, hours, _, _) in self.totals.items():
+            role = roles.setdefault(user_type, {"user_type": user_type, "people": 0, "days": 0, "complete_days": 0,
+                                                "open_days": 0, "hours": 0.0})
+            role["people"] += 1
+            role["days"] += days
+            role["complete_days"] += complete
+            role["open_days"] += days - complete
+            role["hours"] += hours
+        for role in roles.values():
+            role["hours"] = round(role["hours"], 2)
+        return [roles[user_type] for user_type in sorted(roles)]
+
+
+def export(rows, out, fmt="csv", detail=False, by="user", people=None, period=None):
+    """Writes an export of `rows` to the text stream `out` and returns the HoursSummary.
+
+    detail=True writes every row with its hours as it arrives (constant memory, CSV or a JSON array).
+    Otherwise one line per person (by="user") or per role (by="role") is written at the end; JSON
+    then holds both lists plus `period` ({"from", "to"})."""
+    summary = HoursSummary(people)
+    if detail:
+        if fmt == "json":
+            out.write("[")
+            for number, row in enumerate(rows):
+                record = summary.add(row)
+                out.write(("," if number else "") + "\n" + json.dumps({f: record.get(f) for f in ROW_FIELDS}))
+            out.write("\n]\n")
+        else:
+            writer = csv.DictWriter(out, ROW_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(summary.add(row))
+        return summary
+
+    for row in rows:
+        summary.add(row)
+    if fmt == "json":
+        json.dump(dict(period or {}, users=summary.users(), roles=summary.roles()), out, indent=2)
+        out.write("\n")
+    else:
+        records, fields = (summary.roles(), ROLE_FIELDS) if by == "role" else (summary.users(), USER_FIELDS)
+        writer = csv.DictWriter(out, fields)
+        writer.writeheader()
+        writer.writerows(records)
+    return summary
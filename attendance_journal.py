@@ -0,0 +1,166 @@
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from face_metrics import SYNC_RETRIES
+
+# Events sent per request to Supabase
+BATCH_SIZE = 100
+# Retry delay after a failed flush doubles up to this many seconds
+MAX_BACKOFF = 300
+
+
+class AttendanceJournal:
+    """Durable write-behind log of recognized scans, kept in SQLite next to face_data/.
+
+    record() commits the scan locally and returns at once, so the kiosk never waits on the network.
+    A background thread pushes pending events in id order (which keeps each person's scans in order)
+    through push_batch(events) -> {event_key: (action, error)}. A transport failure leaves the whole
+    batch pending and backs off, as do events missing from the result; an event the server rejects
+    is marked failed so it can't block the ones behind it.
+    Every event carries a unique event_key so a resent batch is applied only once.
+    """
+
+    def __init__(self, path, push_batch, batch_size=BATCH_SIZE, max_backoff=MAX_BACKOFF):
+        self.push_batch = push_batch
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()  # one batch in flight at a time
+        self.wake = threading.Event()
+        self.failures = 0
+        self.thread = None
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_key TEXT NOT NULL UNIQUE,
+                user_id TEXT NOT NULL,
+                user_type TEXT,
+                user_name TEXT,
+                date TEXT NOT NULL,
+                ts TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',  -- pending | synced | failed
+                action TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                synced_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS events_status ON events (status, id);
+            CREATE INDEX IF NOT EXISTS events_user_date ON events (user_id, date);
+        """)
+        self.db.commit()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="attendance-flusher", daemon=True)
+            self.thread.start()
+        return self
+
+    def record(self, user_id, user_type, user_name, scanned_at=None):
+        """Commits one scan and wakes the flusher. Returns the event_key."""
+        scanned_at = scanned_at or datetime.now()
+        event_key = uuid.uuid4().hex
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO events (event_key, user_id, user_type, user_name, date, ts) VALUES (?, ?, ?, ?, ?, ?)",
+                (event_key, user_id, user_type, user_name, scanned_at.date().isoformat(), scanned_at.isoformat()))
+            self.db.commit()
+        self.wake.set()
+        return event_key
+
+    def scans_by_user(self, date, pending_only=False):
+        """{user_id: number of scans} recorded (and not rejected) on a day; only unsynced ones if pending_only."""
+        status = "status = 'pending'" if pending_only else "status != 'failed'"
+        with self.lock:
+            return dict(self.db.execute(f"SELECT user_id, COUNT(*) FROM events WHERE date = ? AND {status} "
+                                        "GROUP BY user_id", (date,)).fetchall())
+
+    def last_scans(self, date):
+        """{user_id: (number of scans, time of the latest as a datetime)} recorded (and not rejected) on a day."""
+        with self.lock:
+            rows = self.db.execute("SELECT user_id, COUNT(*), MAX(ts) FROM events WHERE date = ? AND status != 'failed' "
+                                   "GROUP BY user_id", (date,)).fetchall()
+        return {user_id: (count, datetime.fromisoformat(ts)) for user_id, count, ts in rows}
+
+    def pending_count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM events WHERE status = 'pending'").fetchone()[0]
+
+    def flush_once(self):
+        """Pushes one batch. Returns how many events left the pending state; raises on transport errors."""
+        with self.flush_lock:
+            return self._flush_batch()
+
+    def _flush_batch(self):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT event_key, user_id, user_type, user_name, date, ts FROM events "
+                "WHERE status = 'pending' ORDER BY id LIMIT ?", (self.batch_size,)).fetchall()
+        if not rows:
+            return 0
+        events = [dict(zip(("event_key", "user_id", "user_type", "user_name", "date", "ts"), row)) for row in rows]
+        keys = [event["event_key"] for event in events]
+        try:
+            results = self.push_batch(events)
+        except Exception as e:
+            with self.lock:
+                self.db.executemany("UPDATE events SET attempts = attempts + 1, last_error = ? WHERE event_key = ?",
+                                    [(str(e), key) for key in keys])
+                self.db.commit()
+            raise
+
+        now = datetime.now().isoformat()
+        updates = []
+        for key in keys:
+            if key not in results:
+                continue  # not attempted (e.g. the push stopped early); stays pending
+            action, error = results[key]
+            status = "failed" if error else "synced"
+            updates.append((status, action, error, now, key))
+        with self.lock:
+            self.db.executemany("UPDATE events SET status = ?, action = ?, last_error = ?, synced_at = ?, "
+                                "attempts = attempts + 1 WHERE event_key = ?", updates)
+            self.db.commit()
+        for status, action, error, _, key in updates:
+            if error:
+                print(f"Attendance event {key} rejected: {error}")
+        return len(updates)
+
+    def flush(self, timeout=None):
+        """Flushes until nothing is pending or a push fails. Used before a one-shot scanner exits."""
+        deadline = None if timeout is None else time.time() + timeout
+        while deadline is None or time.time() < deadline:
+            try:
+                if not self.flush_once():
+                    return True
+            except Exception as e:
+                print(f"Attendance sync failed, {self.pending_count()} event(s) kept for later: {e}")
+                return False
+        return False
+
+    def _backoff(self):
+        delay = min(2 ** self.failures, self.max_backoff)
+        return delay * random.uniform(0.5, 1.0)
+
+    def _run(self):
+        while True:
+            self.wake.clear()
+            try:
+                while self.flush_once():
+                    pass
+                self.failures = 0
+            except Exception as e:
+                self.failures += 1
+                SYNC_RETRIES.inc()
+                delay = self._backoff()
+                print(f"Attendance sync failed ({e}); retrying in {delay:.0f}s")
+                # Sleep through new scans too; they are safe on disk and go out with the next batch
+                time.sleep(delay)
+                continue
+            self.wake.wait(timeout=60)
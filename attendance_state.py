@@ -0,0 +1,109 @@
+import threading
+from datetime import datetime
+
+# Seconds after an accepted scan during which the same person is not scanned again
+COOLDOWN_SECONDS = 60
+# A day Supabase couldn't be asked about is tried again after this many seconds, doubling up to the maximum
+RESEED_SECONDS = 15
+MAX_RESEED_SECONDS = 600
+
+# Stage of a user's day; each accepted scan moves it one step
+NOT_SEEN, CHECKED_IN, CHECKED_OUT = 0, 1, 2
+ACTIONS = {NOT_SEEN: "check_in", CHECKED_IN: "check_out", CHECKED_OUT: "already_done"}
+
+
+class TodayAttendance:
+    """Today's check-in/check-out state per user, so the scanner decides without asking Supabase.
+
+    A day is installed at once from load_local(date) -> ({user_id: stage}, {user_id: time of last scan})
+    (the journaled scans of every scanner sharing the journal, no network), then load_day(date) -> {user_id: stage} (one bulk query; raises while
+    Supabase is unreachable) runs on a background thread, retried with growing delays, and is merged
+    in when it answers (a day's stages only ever move forward). Neither runs under the lock, so
+    scans never wait for the network. Call seed() when the scanner starts; the first scan on a new
+    date does the same, which rolls the table over at midnight.
+    A person recognized again within `cooldown` seconds of an accepted scan (lingering at the camera,
+    scanning twice) gets the previous message back and no new event, instead of an immediate check-out.
+    Scans taken from load_local count too, so a scanner started right after another one doesn't
+    check out the person the first one just checked in.
+    """
+
+    def __init__(self, load_day, load_local=None, cooldown=COOLDOWN_SECONDS, reseed_delay=RESEED_SECONDS):
+        self.load_day = load_day
+        self.load_local = load_local or (lambda date: ({}, {}))
+        self.cooldown = cooldown
+        self.reseed_delay = reseed_delay
+        self.lock = threading.Lock()
+        self.date = None
+        self.stages = {}
+        self.complete = False  # whether Supabase's view of the day has been merged in
+        self.recent = {}  # user_id -> (time of last accepted scan, message shown or None if not known)
+
+    def seed(self, now=None):
+        """Installs today's table unless it is already there."""
+        self._ensure((now or datetime.now()).date().isoformat())
+
+    def _ensure(self, date):
+        with self.lock:
+            if date == self.date:
+                return
+        stages, last_scans = self.load_local(date)
+        with self.lock:
+            if date == self.date:
+                return  # another thread got there first
+            self.date, self.stages, self.complete = date, dict(stages), False
+            for user_id, scanned_at in last_scans.items():
+                if user_id not in self.recent or self.recent[user_id][0] < scanned_at:
+                    self.recent[user_id] = (scanned_at, None)
+        self._load_later(date, 0)
+
+    def _load_later(self, date, delay):
+        timer = threading.Timer(delay, self._load, (date, delay))
+        timer.daemon = True
+        timer.start()
+
+    def _load(self, date, delay):
+        try:
+            stages = self.load_day(date)
+        except Exception as e:
+            delay = min(max(delay * 2, self.reseed_delay), MAX_RESEED_SECONDS)
+            print(f"Could not load attendance for {date} ({e}); using this scanner's scans, retrying in {delay:.0f}s")
+            with self.lock:
+                if date != self.date:
+                    return
+            self._load_later(date, delay)
+            return
+        with self.lock:
+            if date != self.date:
+                return
+            for user_id, stage in stages.items():
+                self.stages[user_id] = max(stage, self.stages.get(user_id, NOT_SEEN))
+            self.complete = True
+
+    def scan(self, user_id, describe, now=None):
+        """Returns (action, message) for a recognized user. describe(action) builds the message.
+        action is None while the user is in their cooldown; message is then the previous one."""
+        now = now or datetime.now()
+        date = now.date().isoformat()
+        self._ensure(date)
+        with self.lock:
+            recent = self.recent.get(user_id)
+            if recent and (now - recent[0]).total_seconds() < self.cooldown:
+                if recent[1] is None:
+                    # Scanned by another process; repeat what that scan did
+                    previous = ACTIONS[max(self._stage(user_id) - 1, NOT_SEEN)]
+                    recent = self.recent[user_id] = (recent[0], describe(previous))
+                return None, recent[1]
+            stage = self.stages.get(user_id, NOT_SEEN)
+            action = ACTIONS[stage]
+            self.stages[user_id] = min(stage + 1, CHECKED_OUT)
+            message = describe(action)
+            self.recent[user_id] = (now, message)
+            return action, message
+
+    def stage(self, user_id):
+        with self.lock:
+            return self._stage(user_id)
+
+    def _stage(self, user_id):
+        # Called with the lock held
+        return self.stages.get(user_id, NOT_SEEN)
@@ -1,12 +1,38 @@
+import base64
 import http.server
-import socketserver
+import os
 import subprocess
+import tempfile
+import time
 import urllib.parse
 import json
-import os
+from email import policy
+from email.parser import BytesParser
+
+import face_lock
+import face_metrics
+from face_batch import image_frames
+from face_engine import RecognitionEngine
 
 PORT = 5001
 
+# Longest a single long-poll request may block
+MAX_WAIT_SECONDS = 60
+# Interval between SSE keep-alive comments
+SSE_HEARTBEAT_SECONDS = 15
+# Largest image batch accepted in one request body (videos are spooled to disk and not limited)
+MAX_IMAGE_BATCH_BYTES = 256 * 1024 * 1024
+# /recognize?path= only reads files under this folder, and only for requests from this machine.
+# Unset, ?path= is refused: any web page can make the browser call the bridge
+RECORDINGS_DIR = os.environ.get("FACE_RECORDINGS_DIR")
+
+# Model, cascade and camera stay loaded here instead of cold-starting face_lock.py per scan
+engine = RecognitionEngine()
+
+face_metrics.Gauge("hms_jobs_queued", "Bridge jobs waiting for the engine", lambda: engine.jobs.qsize())
+face_metrics.Gauge("hms_attendance_journal_pending", "Scans journaled locally and not yet synced to Supabase",
+                   lambda: engine.journal.pending_count() if engine.journal else None)
+
 class BridgeHandler(http.server.SimpleHTTPRequestHandler):
     def do_OPTIONS(self):
         self.send_response(200, "ok")
@@ -15,16 +41,34 @@ class BridgeHandler(http.server.SimpleHTTPRequestHandler):
         self.send_header("Access-Control-Allow-Headers", "X-Requested-With, Content-Type")
         self.end_headers()
 
-    def do_GET(self):
-        self.send_response(200)
+    def send_json(self, data, code=200):
+        self.send_response(code)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Content-type', 'application/json')
         self.end_headers()
-        
+        self.wfile.write(json.dumps(data).encode())
+
+    def send_job_started(self, job, coalesced, message):
+        """Replies to /register and /verify with the job ID to poll."""
+        if coalesced:
+            message = "Already in progress"
+        self.send_json({"status": "started", "message": message, "job_id": job.id,
+                        "coalesced": coalesced, "state": job.state})
+
+    def do_GET(self):
         parsed_path = urllib.parse.urlparse(self.path)
         params = urllib.parse.parse_qs(parsed_path.query)
         
-        if parsed_path.path == '/register':
+        if parsed_path.path.startswith('/jobs/'):
+            self.handle_job(parsed_path.path[len('/jobs/'):], params)
+
+        elif parsed_path.path == '/metrics':
+            self.send_metrics()
+
+        elif parsed_path.path == '/recognize':
+            self.handle_recognize(params)
+
+        elif parsed_path.path == '/register':
             worker_id = params.get('id', [None])[0]
             name_param = params.get('name', [None])[0]
             type_param = params.get('type', [None])[0]
@@ -37,45 +81,250 @@ class BridgeHandler(http.server.SimpleHTTPRequestHandler):
             if worker_id:
                 print(f"Triggering registration for {worker_name} (ID: {worker_id}, Type: {user_type})...")
                 try:
-                    # Pass credentials via ENV
-                    curr_env = os.environ.copy()
-                    if supa_key: curr_env['VITE_SUPABASE_KEY'] = supa_key
-                    if supa_url: curr_env['VITE_SUPABASE_URL'] = supa_url
+                    # Pass credentials to the engine job
+                    job_env = {}
+                    if supa_key: job_env['VITE_SUPABASE_KEY'] = supa_key
+                    if supa_url: job_env['VITE_SUPABASE_URL'] = supa_url
 
-                    # Launch the process
-                    subprocess.Popen(['python', 'face_lock.py', 'register', worker_id, worker_name, user_type], env=curr_env)
+                    job, coalesced = engine.submit('register', worker_id, worker_name, user_type, env=job_env)
                     
-                    focus_cmd = f'powershell -Command "$wshell = New-Object -ComObject WScript.Shell; sleep 1; $wshell.AppActivate(\'Face Registration - Stay Still\')"'
-                    subprocess.Popen(focus_cmd, shell=True)
+                    if not coalesced:
+                        focus_cmd = f'powershell -Command "$wshell = New-Object -ComObject WScript.Shell; sleep 1; $wshell.AppActivate(\'Face Registration - Stay Still\')"'
+                        subprocess.Popen(focus_cmd, shell=True)
                     
-                    self.wfile.write(json.dumps({"status": "started", "message": f"Registration started for {worker_name}"}).encode())
+                    self.send_job_started(job, coalesced, f"Registration started for {worker_name}")
                 except Exception as e:
-                    print(f"Subprocess failed: {e}")
-                    self.wfile.write(json.dumps({"status": "error", "message": str(e)}).encode())
+                    print(f"Registration failed: {e}")
+                    self.send_json({"status": "error", "message": str(e)})
             else:
                 print("Registration failed: Missing worker ID")
-                self.wfile.write(json.dumps({"status": "error", "message": "Missing ID"}).encode())
+                self.send_json({"status": "error", "message": "Missing ID"}, 400)
                 
         elif parsed_path.path == '/verify':
-            print("Triggering verification scanner...")
+            continuous = params.get('continuous', ['0'])[0] not in ('0', '')
+            print("Triggering continuous scanner..." if continuous else "Triggering verification scanner...")
             supa_key = params.get('key', [None])[0]
             supa_url = params.get('url', [None])[0]
 
-            # Pass credentials via ENV
-            curr_env = os.environ.copy()
-            if supa_key: curr_env['VITE_SUPABASE_KEY'] = supa_key
-            if supa_url: curr_env['VITE_SUPABASE_URL'] = supa_url
+            # Pass credentials to the engine job
+            job_env = {}
+            if supa_key: job_env['VITE_SUPABASE_KEY'] = supa_key
+            if supa_url: job_env['VITE_SUPABASE_URL'] = supa_url
 
-            subprocess.Popen(['python', 'face_lock.py', 'verify'], env=curr_env)
+            job, coalesced = engine.submit('kiosk' if continuous else 'verify', env=job_env)
             
-            focus_cmd = 'powershell -Command "$wshell = New-Object -ComObject WScript.Shell; sleep 1; $wshell.AppActivate(\'Attendance Scanner\')"'
-            subprocess.Popen(focus_cmd, shell=True)
+            if not coalesced:
+                focus_cmd = 'powershell -Command "$wshell = New-Object -ComObject WScript.Shell; sleep 1; $wshell.AppActivate(\'Attendance Scanner\')"'
+                subprocess.Popen(focus_cmd, shell=True)
             
-            self.wfile.write(json.dumps({"status": "started", "message": "Verification scanner started"}).encode())
+            self.send_job_started(job, coalesced, "Continuous scanner started" if continuous else "Verification scanner started")
         
+        elif parsed_path.path == '/stop':
+            job = engine.stop_kiosk()
+            if job is None:
+                self.send_json({"status": "idle", "message": "No continuous scanner running"})
+            else:
+                print("Stopping continuous scanner...")
+                self.send_json({"status": "stopping", "message": "Continuous scanner stopping", "job_id": job.id})
+
+        else:
+            self.send_json({"status": "ready", "message": "Bridge is active"})
+
+    def do_POST(self):
+        parsed_path = urllib.parse.urlparse(self.path)
+        params = urllib.parse.parse_qs(parsed_path.query)
+
+        if parsed_path.path == '/recognize':
+            self.handle_recognize(params)
         else:
-            self.wfile.write(json.dumps({"status": "ready", "message": "Bridge is active"}).encode())
+            self.send_json({"status": "error", "message": "Unknown endpoint"}, 404)
+
+    def handle_recognize(self, params):
+        """Batch recognition without a window; streams one JSON line per frame (see FACE_SCANNER_DEPLOYMENT.md).
+           POST /recognize            body: a video file, one image, multipart images or {"images": [base64, ...]}
+           GET|POST /recognize?path=  a video file or image folder on this machine
+           &step=N  only every N-th video frame     &workers=N  size of the worker pool
+           &min_face=PX  ignore faces narrower than PX pixels (faster; default: full resolution)"""
+        # Snapshot the engine's model; a registration swapping it mid-batch doesn't affect this request.
+        # Never load it here: that would re-map model.bin or touch the shared LBPH recognizer under the engine
+        id_map, recognize = engine.model()
+        if id_map is None or recognize is None:
+            message = "Model not trained. Register workers first." if not face_lock.model_exists() \
+                else "Model is being updated. Try again in a few seconds."
+            self.send_json({"status": "error", "message": message}, 503)
+            return
+        path = params.get('path', [None])[0]
+        spooled = None
+        try:
+            try:
+                step = max(1, int(params.get('step', [1])[0]))
+                workers = int(params.get('workers', [0])[0]) or None
+                min_face = int(params.get('min_face', [0])[0]) or None
+            except ValueError:
+                raise ValueError("step, workers and min_face must be whole numbers")
+            if workers is not None and workers < 0 or min_face is not None and min_face < 0:
+                raise ValueError("workers and min_face must be positive")
+            if workers is not None:
+                workers = min(workers, os.cpu_count() or 1)
+            if path:
+                refused = self.refuse_path(path)
+                if refused:
+                    self.send_json({"status": "error", "message": refused}, 403)
+                    return
+                if not os.path.exists(path):
+                    self.send_json({"status": "error", "message": f"Not found: {path}"}, 404)
+                    return
+                results = face_lock.recognize_file(path, step, id_map, recognize, workers, min_face)
+            else:
+                length = int(self.headers.get('Content-Length', 0))
+                content_type = self.headers.get('Content-Type', 'application/octet-stream')
+                if not length:
+                    self.send_json({"status": "error", "message": "Send a video or images, or pass ?path="}, 400)
+                    return
+                if content_type.startswith(('video/', 'application/octet-stream')):
+                    spooled = self.spool_body(length)
+                    results = face_lock.recognize_file(spooled, step, id_map, recognize, workers, min_face)
+                elif length > MAX_IMAGE_BATCH_BYTES:
+                    self.send_json({"status": "error", "message": "Image batch too large"}, 413)
+                    return
+                else:
+                    images = self.read_images(content_type, self.rfile.read(length))
+                    # Fail before the 200 goes out; in a batch an unreadable image is reported on its own line
+                    if not images:
+                        raise ValueError("No images in the request")
+                    if len(images) == 1 and next(image_frames(images))[2] is None:
+                        raise ValueError("Cannot decode the image")
+                    results = face_lock.recognize_batch(image_frames(images), id_map, recognize, workers, min_face=min_face)
+            self.stream_results(results)
+        except ValueError as e:
+            self.send_json({"status": "error", "message": str(e)}, 400)
+        finally:
+            if spooled:
+                os.remove(spooled)
+
+    def refuse_path(self, path):
+        """Why ?path= may not be read for this request, or None if it may."""
+        if not RECORDINGS_DIR:
+            return "Set FACE_RECORDINGS_DIR on the bridge to recognize files on this machine"
+        if self.client_address[0] not in ('127.0.0.1', '::1'):
+            return "?path= is only accepted from this machine"
+        root = os.path.realpath(RECORDINGS_DIR)
+        try:
+            inside = os.path.commonpath([root, os.path.realpath(path)]) == root
+        except ValueError:
+            inside = False  # another drive on Windows
+        return None if inside else f"Only files under {RECORDINGS_DIR} can be recognized"
+
+    def spool_body(self, length):
+        """Copies an uploaded video to a temporary file (OpenCV only decodes from files)."""
+        with tempfile.NamedTemporaryFile(prefix="hms_upload_", delete=False) as f:
+            remaining = length
+            while remaining > 0:
+                chunk = self.rfile.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                f.write(chunk)
+                remaining -= len(chunk)
+        return f.name
+
+    def read_images(self, content_type, body):
+        """Returns [(name, encoded bytes)] from a single image, multipart/form-data or a JSON list of base64 images."""
+        if content_type.startswith('multipart/'):
+            message = BytesParser(policy=policy.default).parsebytes(
+                b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+            return [(part.get_filename() or str(i), part.get_payload(decode=True))
+                    for i, part in enumerate(message.iter_parts())]
+        if content_type.startswith('application/json'):
+            images = json.loads(body).get("images", [])
+            return [(str(i), base64.b64decode(data.split(",", 1)[-1])) for i, data in enumerate(images)]
+        return [("0", body)]
+
+    def stream_results(self, results):
+        """Writes newline-delimited JSON as frames finish, then a summary line."""
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Content-type', 'application/x-ndjson')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        started = time.time()
+        frames = faces = 0
+        try:
+            for result in results:
+                frames += 1
+                faces += len(result["faces"])
+                self.wfile.write((json.dumps(result) + "\n").encode())
+                self.wfile.flush()
+            summary = {"done": True, "frames": frames, "faces": faces, "seconds": round(time.time() - started, 3)}
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away; closing the generator stops the worker pool
+            results.close()
+            return
+        except Exception as e:
+            print(f"Batch recognition failed: {e}")
+            summary = {"done": False, "frames": frames, "error": str(e)}
+        self.wfile.write((json.dumps(summary) + "\n").encode())
+
+    def send_metrics(self):
+        """Prometheus scrape endpoint."""
+        body = face_metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_job(self, job_path, params):
+        """GET /jobs/<id>                    -> current state
+           GET /jobs/<id>?wait=30[&since=N]  -> long-poll until finished (or version > N)
+           GET /jobs/<id>/events             -> server-sent events until finished"""
+        job_id, _, action = job_path.partition('/')
+        job = engine.get_job(job_id)
+        if job is None:
+            self.send_json({"status": "error", "message": "Unknown job"}, 404)
+            return
+
+        if action == 'events':
+            self.stream_job_events(job)
+            return
+
+        try:
+            wait = min(float(params.get('wait', [0])[0]), MAX_WAIT_SECONDS)
+            since = params.get('since', [None])[0]
+            since = int(since) if since is not None else None
+        except ValueError:
+            self.send_json({"status": "error", "message": "wait and since must be numbers"}, 400)
+            return
+        if wait > 0:
+            self.send_json(job.wait(since, timeout=wait))
+        else:
+            self.send_json(job.to_dict())
+
+    def stream_job_events(self, job):
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Content-type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        version = -1
+        try:
+            while True:
+                snapshot = job.wait(version, timeout=SSE_HEARTBEAT_SECONDS)
+                if snapshot['version'] == version:
+                    self.wfile.write(b": keep-alive\n\n")
+                else:
+                    version = snapshot['version']
+                    self.wfile.write(f"event: {snapshot['state']}\ndata: {json.dumps(snapshot)}\n\n".encode())
+                self.wfile.flush()
+                if snapshot['state'] in ('done', 'error'):
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            pass
 
-print(f"HMS Python Bridge running on http://localhost:{PORT}")
-with socketserver.TCPServer(("", PORT), BridgeHandler) as httpd:
-    httpd.serve_forever()
+if __name__ == "__main__":
+    engine.start()
+    face_metrics.STAGE_SECONDS.observe(time.time() - face_metrics.PROCESS_START, "startup")
+    print(f"HMS Python Bridge running on http://localhost:{PORT}")
+    # One thread per request so long-polls and SSE streams don't block other callers
+    with http.server.ThreadingHTTPServer(("", PORT), BridgeHandler) as httpd:
+        httpd.serve_forever()
@@ -0,0 +1,93 @@
+-- Single round-trip check-in / check-out for the face scanner (face_lock.py)
+-- The scanner calls POST /rest/v1/rpc/mark_attendance once per recognized face.
+-- Without this function it falls back to a lookup plus one insert/update (two round trips).
+
+-- 1. Column the scanner records the role in
+ALTER TABLE public.attendance ADD COLUMN IF NOT EXISTS user_type text;
+
+-- 2. Check in on the first scan of the day, check out on the second, report on later ones
+CREATE OR REPLACE FUNCTION public.mark_attendance(p_user_id uuid, p_user_type text, p_date date, p_time timestamptz)
+RETURNS json AS $$
+DECLARE
+  rec public.attendance%ROWTYPE;
+BEGIN
+  -- Serialize scans of the same person on the same day so two gates can't both check in
+  PERFORM pg_advisory_xact_lock(hashtext(p_user_id::text || p_date::text));
+
+  SELECT * INTO rec FROM public.attendance
+  WHERE user_id = p_user_id AND date = p_date
+  ORDER BY created_at
+  LIMIT 1;
+
+  IF NOT FOUND THEN
+    INSERT INTO public.attendance (user_id, user_type, date, status, check_in)
+    VALUES (p_user_id, p_user_type, p_date, 'present', p_time)
+    RETURNING * INTO rec;
+    RETURN json_build_object('action', 'check_in', 'id', rec.id, 'check_in', rec.check_in, 'check_out', rec.check_out);
+  END IF;
+
+  IF rec.check_out IS NOT NULL THEN
+    RETURN json_build_object('action', 'already_done', 'id', rec.id, 'check_in', rec.check_in, 'check_out', rec.check_out);
+  END IF;
+
+  UPDATE public.attendance SET check_out = p_time WHERE id = rec.id
+  RETURNING * INTO rec;
+  RETURN json_build_object('action', 'check_out', 'id', rec.id, 'check_in', rec.check_in, 'check_out', rec.check_out);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- 3. Allow the scanner's anon key to call it
+GRANT EXECUTE ON FUNCTION public.mark_attendance(uuid, text, date, timestamptz) TO anon, authenticated;
+
+-- 4. Scans already applied, so a kiosk can safely resend a batch after a timeout
+CREATE TABLE IF NOT EXISTS public.attendance_scan_events (
+  event_key text NOT NULL,
+  user_id uuid,
+  scanned_at timestamp with time zone,
+  action text,
+  created_at timestamp with time zone NOT NULL DEFAULT timezone('utc'::text, now()),
+  CONSTRAINT attendance_scan_events_pkey PRIMARY KEY (event_key)
+);
+ALTER TABLE public.attendance_scan_events ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "Public Attendance Scan Events" ON public.attendance_scan_events;
+CREATE POLICY "Public Attendance Scan Events" ON public.attendance_scan_events FOR ALL USING (true) WITH CHECK (true);
+
+-- 5. Apply a batch of journaled scans in order (one request per batch from the scanner's journal)
+-- p_events: [{"event_key", "user_id", "user_type", "date", "ts"}, ...]
+-- Returns one {"event_key", "action"[, "duplicate" | "error"]} per event.
+CREATE OR REPLACE FUNCTION public.mark_attendance_batch(p_events json)
+RETURNS json AS $$
+DECLARE
+  ev json;
+  result json;
+  prior text;
+  results json[] := '{}';
+BEGIN
+  FOR ev IN SELECT * FROM json_array_elements(p_events) LOOP
+    BEGIN
+      INSERT INTO public.attendance_scan_events (event_key, user_id, scanned_at)
+      VALUES (ev->>'event_key', (ev->>'user_id')::uuid, (ev->>'ts')::timestamptz)
+      ON CONFLICT (event_key) DO NOTHING;
+
+      IF NOT FOUND THEN
+        SELECT action INTO prior FROM public.attendance_scan_events WHERE event_key = ev->>'event_key';
+        results := results || json_build_object('event_key', ev->>'event_key', 'action', prior, 'duplicate', true);
+        CONTINUE;
+      END IF;
+
+      result := public.mark_attendance((ev->>'user_id')::uuid, ev->>'user_type', (ev->>'date')::date, (ev->>'ts')::timestamptz);
+      UPDATE public.attendance_scan_events SET action = result->>'action' WHERE event_key = ev->>'event_key';
+      results := results || json_build_object('event_key', ev->>'event_key', 'action', result->>'action');
+    EXCEPTION WHEN others THEN
+      -- e.g. a user that no longer exists; the rest of the batch still goes through
+      results := results || json_build_object('event_key', ev->>'event_key', 'action', 'error', 'error', SQLERRM);
+    END;
+  END LOOP;
+  RETURN array_to_json(results);
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+GRANT EXECUTE ON FUNCTION public.mark_attendance_batch(json) TO anon, authenticated;
+
+-- 6. Index for the payroll export (python face_lock.py export), which reads one day at a time in id order
+CREATE INDEX IF NOT EXISTS attendance_date_id_idx ON public.attendance (date, id);
@@ -0,0 +1,124 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from face_gates import CASCADE_FILE
+from face_pipeline import FULL_SCAN_INTERVAL, IMAGE_EXTENSIONS, FaceDetector, process_frame, single_threaded_opencv
+
+# Consecutive frames handed to a worker at once. Within a batch of video frames the detector
+# tracks faces from one frame to the next instead of scanning every frame in full.
+BATCH_SIZE = 16
+
+def video_frames(path, step=1):
+    """(index, seconds, frame) for every step-th frame of a video file. Skipped frames are only
+    grabbed, not decoded into images. Raises ValueError right away if the file can't be opened."""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        capture.release()
+        raise ValueError(f"Cannot open video: {path}")
+    return _read_video(capture, step)
+
+
+def _read_video(capture, step):
+    fps = capture.get(cv2.CAP_PROP_FPS) or 0
+    index = 0
+    try:
+        while True:
+            if index % step:
+                if not capture.grab():
+                    break
+            else:
+                ret, frame = capture.read()
+                if not ret:
+                    break
+                yield index, round(index / fps, 3) if fps else None, frame
+            index += 1
+    finally:
+        capture.release()
+
+
+def image_frames(images):
+    """Yields (index, name, frame) for (name, encoded bytes) pairs; frame is None if it can't be decoded."""
+    for index, (name, data) in enumerate(images):
+        frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) if data else None
+        yield index, name, frame
+
+
+def folder_frames(folder):
+    """image_frames() for the images of a directory, in name order."""
+    names = sorted(f for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+    def read(name):
+        with open(os.path.join(folder, name), "rb") as f:
+            return f.read()
+    return image_frames((name, read(name)) for name in names)
+
+
+class BatchRecognizer:
+    """Runs detection and recognition over a finite sequence of frames on a pool of worker threads,
+    without a window. The caller's thread reads (and decodes) frames and groups them into batches;
+    workers process whole batches (see face_pipeline.process_frame), and results come back in input
+    order. At most a couple of batches per worker are in flight, so memory stays flat however long
+    the video is. track=True lets the detector follow faces between the consecutive frames of a batch; leave it
+    off for unrelated images. Frames are scanned at full resolution, since faces in CCTV footage are
+    often small; min_face (pixels) ignores smaller faces and lets the detector downscale.
+    """
+
+    def __init__(self, recognize, workers=None, batch_size=BATCH_SIZE, track=False, min_face=None):
+        self.recognize = recognize
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.track = track
+        # Not FACE_MIN_FACE_WIDTH: that is tuned for the live door camera, not for recordings
+        self.min_size = (min_face, min_face) if min_face else (0, 0)
+        self.local = threading.local()
+
+    def run(self, frames):
+        """frames yields (index, tag, frame). Yields (index, tag, RecognizedFrame or None if the frame was unreadable)."""
+        if self.workers == 1:
+            yield from self._run(frames)
+            return
+        with single_threaded_opencv():
+            yield from self._run(frames)
+
+    def _run(self, frames):
+        in_flight = deque()
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="batch-recognize") as pool:
+            batch = []
+            for item in frames:
+                batch.append(item)
+                if len(batch) == self.batch_size:
+                    in_flight.append(pool.submit(self._process_batch, batch))
+                    batch = []
+                    while len(in_flight) > 2 * self.workers:
+                        yield from in_flight.popleft().result()
+            if batch:
+                in_flight.append(pool.submit(self._process_batch, batch))
+            while in_flight:
+                yield from in_flight.popleft().result()
+
+    def _detector(self):
+        detector = getattr(self.local, "detector", None)
+        if detector is None:
+            full_scan_interval = FULL_SCAN_INTERVAL if self.track else 0
+            detector = self.local.detector = FaceDetector(cv2.CascadeClassifier(CASCADE_FILE), 1.2, 5, self.min_size,
+                                                          full_scan_interval=full_scan_interval)
+        detector.reset()
+        return detector
+
+    def _process_batch(self, batch):
+        detector = self._detector()
+        results = []
+        for index, tag, frame in batch:
+            if frame is None:
+                detector.reset()
+                results.append((index, tag, None))
+                continue
+            result = process_frame(detector, self.recognize, index, frame)
+            result.frame = result.gray = None  # results wait to be yielded in order; don't keep the images
+            results.append((index, tag, result))
+        return results
@@ -0,0 +1,323 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+import face_lock
+from attendance_journal import AttendanceJournal
+from face_gallery import GalleryMatcher, gallery_file, lbp_histogram, load_gallery, write_lbph_model
+from face_pipeline import FaceDetector, open_frame_source
+from face_samples import SAMPLES_PER_PERSON
+from face_store import SampleStore, pack_folders
+from postgrest_stub import PostgrestStub
+
+# Offline benchmark of the scanner stages. No camera or Supabase needed: frames come from a video file,
+# an image folder or the crops in face_data/, identities are synthesized, and attendance is written to
+# an in-process PostgREST stub. Prints one JSON document, so runs can be diffed between releases:
+#   python face_benchmark.py --output bench.json
+#   python face_benchmark.py --source recordings/gate1.mp4 --stages detect
+
+STAGES = ("detect", "predict", "train", "attendance")
+
+
+def timings(seconds):
+    """Summary of a list of durations in milliseconds."""
+    ms = sorted(s * 1000 for s in seconds)
+    return {"count": len(ms), "mean_ms": round(statistics.fmean(ms), 3), "p50_ms": round(ms[len(ms) // 2], 3),
+            "p95_ms": round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 3), "max_ms": round(ms[-1], 3)}
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def face_crops(face_dir, limit=None):
+    """Grayscale face crops saved by registration, in folder order (or store order once packed)."""
+    if SampleStore.exists(face_dir):
+        crops = list(SampleStore(face_dir).array()[:limit])
+        if not crops:
+            raise SystemExit(f"No face samples in {face_dir}; register someone or pass --face-data")
+        return crops
+    crops = []
+    for worker in sorted(os.listdir(face_dir)):
+        worker_path = os.path.join(face_dir, worker)
+        if not os.path.isdir(worker_path):
+            continue
+        crops.extend(face_lock.read_worker_samples(worker_path))
+        if limit and len(crops) >= limit:
+            break
+    if not crops:
+        raise SystemExit(f"No face images found in {face_dir}; register someone or pass --face-data")
+    return crops[:limit]
+
+
+def synthetic_frames(crops, count, width=640, height=480, seed=0):
+    """Camera-like frames: a face crop drifting over a noisy background, changing every few frames."""
+    rng = np.random.default_rng(seed)
+    background = np.tile(np.linspace(60, 160, width, dtype=np.float32), (height, 1))
+    frames = []
+    for i in range(count):
+        frame = np.clip(background + rng.normal(0, 6, background.shape), 0, 255).astype(np.uint8)
+        crop = crops[(i // 5) % len(crops)]
+        x = int((width - crop.shape[1]) / 2 + 40 * np.sin(i / 30))
+        y = max(0, (height - crop.shape[0]) // 2)
+        frame[y:y + crop.shape[0], x:x + crop.shape[1]] = crop[:height - y, :width - x]
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+    return frames
+
+
+def read_frames(source, limit):
+    capture = open_frame_source(source)
+    frames = []
+    while len(frames) < limit:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+# --- Stages ------------------------------------------------------------------------
+
+def bench_detect(frames):
+    """Frames per second of face detection (grayscale conversion included)."""
+    detectors = {
+        "tracking": FaceDetector(face_lock.face_cascade, 1.2, 5),
+        "full_resolution": lambda gray: face_lock.face_cascade.detectMultiScale(gray, 1.2, 5),
+    }
+    results = {"frames": len(frames), "frame_size": list(frames[0].shape[1::-1])}
+    for name, detect in detectors.items():
+        faces = 0
+        start = time.perf_counter()
+        for frame in frames:
+            faces += len(detect(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)))
+        elapsed = time.perf_counter() - start
+        results[name] = {"fps": round(len(frames) / elapsed, 1), "faces_per_frame": round(faces / len(frames), 3)}
+    return results
+
+
+def synthetic_gallery(real, people, samples, rng, chunk=256):
+    """(gallery_t, labels, sums) for `people` made-up identities of `samples` histograms each.
+    Each identity is a real histogram with per-bin noise, each sample adds a little more; cells are
+    renormalized so the histograms look like LBPH output. Built straight in the bins x entries layout."""
+    bins = real.shape[1]
+    cells = bins // 256
+    gallery_t = np.empty((bins, people * samples), dtype=np.float32)
+    for first in range(0, people, chunk):
+        count = min(chunk, people - first)
+        base = real[rng.integers(0, len(real), count)] * rng.gamma(4.0, 0.25, (count, bins)).astype(np.float32)
+        block = np.repeat(base, samples, axis=0) * rng.gamma(16.0, 1 / 16.0, (count * samples, bins)).astype(np.float32)
+        block = block.reshape(-1, cells, 256)
+        block /= np.maximum(block.sum(axis=2, keepdims=True), np.float32(1e-9))
+        gallery_t[:, first * samples:(first + count) * samples] = block.reshape(-1, bins).T
+    labels = np.repeat(np.arange(people, dtype=np.int32), samples)
+    return gallery_t, labels, gallery_t.sum(axis=0)
+
+
+def bench_predict(crops, sizes, samples, probes, lbph_max_people, seed=0):
+    """Per-face recognition latency (histogram + nearest neighbour) as the gallery grows."""
+    params = face_lock.lbph_params()
+    real = np.stack([lbp_histogram(crop, **params) for crop in crops[:200]])
+    probe_crops = crops[:probes]
+    rng = np.random.default_rng(seed)
+    results = []
+    for people in sizes:
+        segment = synthetic_gallery(real, people, samples, rng)
+        row = {"people": people, "entries": people * samples}
+        for name, prototypes in (("gallery", False), ("prototype", True)):
+            matcher = GalleryMatcher.from_segments([segment], params, prototypes)
+            row[name] = timings([timed(matcher, crop, [(0, 0, crop.shape[1], crop.shape[0])])[0]
+                                 for crop in probe_crops])
+        if people <= lbph_max_people:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "trainer.yml")
+                write_lbph_model(path, segment[0].T, segment[1], params)
+                recognizer = cv2.face.LBPHFaceRecognizer_create()
+                recognizer.read(path)
+            row["lbph"] = timings([timed(recognizer.predict, crop)[0] for crop in probe_crops])
+        del segment
+        results.append(row)
+    return results
+
+
+def augmented(crop, rng):
+    """A slightly different shot of the same face: mirrored, shifted brightness, sensor noise."""
+    image = crop[:, ::-1] if rng.random() < 0.5 else crop
+    image = image.astype(np.float32) * rng.uniform(0.8, 1.2) + rng.normal(0, 4, image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+@contextlib.contextmanager
+def face_data_at(path):
+    """Points face_lock's model files at another face_data directory for the duration."""
+    names = ("FACE_DATA_DIR", "TRAINER_FILE", "MAP_FILE", "MODEL_FILE")
+    saved = {name: getattr(face_lock, name) for name in names}
+    face_lock.FACE_DATA_DIR = path
+    face_lock.TRAINER_FILE = os.path.join(path, "trainer.yml")
+    face_lock.MAP_FILE = os.path.join(path, "id_map.json")
+    face_lock.MODEL_FILE = os.path.join(path, "model.bin")
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(face_lock, name, value)
+
+
+def write_person(face_dir, crops, samples, rng):
+    worker_id = str(uuid.uuid4())
+    worker_path = os.path.join(face_dir, worker_id)
+    os.makedirs(worker_path)
+    with open(os.path.join(worker_path, "meta.json"), "w") as f:
+        json.dump({"name": f"Bench {worker_id[:8]}", "type": "worker", "id": worker_id}, f)
+    for number in range(1, samples + 1):
+        cv2.imwrite(os.path.join(worker_path, f"{number}.jpg"), augmented(crops[rng.integers(len(crops))], rng))
+    return worker_id
+
+
+def bench_train(crops, people, samples, seed=0):
+    """Full rebuild (cold and with warm feature caches) from JPEG folders and from the packed sample store,
+    one incremental enrollment, and model load."""
+    rng = np.random.default_rng(seed)
+    with tempfile.TemporaryDirectory() as tmp, face_data_at(tmp):
+        for _ in range(people):
+            write_person(tmp, crops, samples, rng)
+        results = {"people": people, "images": people * samples, "processes": os.cpu_count()}
+        results["full_rebuild_cold_s"] = round(timed(face_lock.train_model)[0], 3)
+        results["full_rebuild_warm_s"] = round(timed(face_lock.train_model)[0], 3)
+        new_worker = write_person(tmp, crops, samples, rng)
+        results["incremental_enroll_s"] = round(timed(face_lock.enroll_worker, new_worker)[0], 3)
+        results["model_bin_bytes"] = os.path.getsize(gallery_file(face_lock.MODEL_FILE))
+
+        # The same people packed into samples.bin: one sequential read instead of a file per image
+        results["pack_samples_s"] = round(timed(pack_folders, tmp)[0], 3)
+        results["packed_rebuild_cold_s"] = round(timed(face_lock.train_model)[0], 3)
+        results["packed_rebuild_warm_s"] = round(timed(face_lock.train_model)[0], 3)
+        results["samples_bin_bytes"] = os.path.getsize(os.path.join(tmp, "samples.bin"))
+
+        load_seconds, gallery = timed(load_gallery, face_lock.MODEL_FILE)
+        crop = crops[0]
+        first_predict, _ = timed(gallery, crop, [(0, 0, crop.shape[1], crop.shape[0])])
+        del gallery
+        write_lbph_model(face_lock.TRAINER_FILE, *_model_histograms(face_lock.MODEL_FILE), face_lock.lbph_params())
+        recognizer = cv2.face.LBPHFaceRecognizer_create()
+        results["model_load"] = {
+            "model_bin_ms": round(load_seconds * 1000, 3),
+            "model_bin_first_predict_ms": round(first_predict * 1000, 3),
+            "trainer_yml_ms": round(timed(recognizer.read, face_lock.TRAINER_FILE)[0] * 1000, 3),
+            "trainer_yml_bytes": os.path.getsize(face_lock.TRAINER_FILE),
+        }
+    return results
+
+
+def _model_histograms(path):
+    gallery = load_gallery(path)
+    histograms = np.concatenate([np.asarray(g).T for g, _, _ in gallery.segments])
+    labels = np.concatenate([np.asarray(l) for _, l, _ in gallery.segments])
+    return histograms, labels
+
+
+def bench_attendance(scans, latency):
+    """Attendance write latency against a local PostgREST stub (optionally with simulated round-trip time):
+    the mark_attendance() RPC, the table fallback, and the journaled path the scanner uses."""
+    saved_url, saved_journal, saved_today = face_lock.SUPABASE_URL, face_lock._journal, face_lock._today
+    users = [str(uuid.uuid4()) for _ in range(scans)]
+    results = {"scans": scans, "simulated_latency_ms": latency * 1000}
+    try:
+        for name, rpc in (("rpc", True), ("table_fallback", False)):
+            with PostgrestStub(rpc=rpc, latency=latency) as stub:
+                face_lock.SUPABASE_URL = stub.url
+                durations = [timed(face_lock.send_attendance, user, "worker", "Bench")[0] for user in users]
+                results[name] = dict(timings(durations), requests=stub.requests)
+
+        with PostgrestStub(latency=latency) as stub, tempfile.TemporaryDirectory() as tmp:
+            face_lock.SUPABASE_URL = stub.url
+            face_lock._journal = AttendanceJournal(os.path.join(tmp, "journal.db"), face_lock.push_attendance_batch)
+            face_lock._today = None
+            seed_seconds, _ = timed(face_lock.load_attendance_day, datetime.now().date().isoformat())
+            durations = [timed(face_lock.record_attendance, user, "worker", "Bench")[0] for user in users]
+            flush_seconds, _ = timed(face_lock._journal.flush)
+            results["journaled"] = dict(timings(durations), day_seed_ms=round(seed_seconds * 1000, 3),
+                                        flush_ms=round(flush_seconds * 1000, 3),
+                                        pending_after_flush=face_lock._journal.pending_count(),
+                                        requests=stub.requests)
+            face_lock._journal.db.close()
+    finally:
+        face_lock.SUPABASE_URL, face_lock._journal, face_lock._today = saved_url, saved_journal, saved_today
+    return results
+
+
+def environment():
+    commit = None
+    with contextlib.suppress(OSError, ValueError):
+        with open(os.path.join(".git", "HEAD")) as f:
+            head = f.read().strip()
+        if head.startswith("ref: "):
+            with open(os.path.join(".git", head[5:])) as f:
+                head = f.read().strip()
+        commit = head
+    return {"time": datetime.now().isoformat(timespec="seconds"), "commit": commit,
+            "python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "opencv": cv2.__version__, "numpy": np.__version__,
+            "matcher": face_lock.MATCHER}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the face scanner stages")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma-separated subset of " + ", ".join(STAGES))
+    parser.add_argument("--source", help="video file or image folder for detection (default: synthetic frames)")
+    parser.add_argument("--face-data", default=face_lock.FACE_DATA_DIR, help="registered faces to draw crops from")
+    parser.add_argument("--frames", type=int, default=300, help="frames to run detection on")
+    parser.add_argument("--people", default="10,100,1000",
+                        help="gallery sizes (identities) for predict latency; RAM is about people x samples x 64 KB")
+    parser.add_argument("--samples", type=int, default=SAMPLES_PER_PERSON, help="histograms per identity")
+    parser.add_argument("--probes", type=int, default=50, help="faces timed per gallery size")
+    parser.add_argument("--lbph-max-people", type=int, default=100, help="largest gallery also timed with OpenCV LBPH")
+    parser.add_argument("--train-people", type=int, default=50, help="people in the training benchmark")
+    parser.add_argument("--scans", type=int, default=200, help="attendance scans to write")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated network round trip per request")
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(sorted(unknown))}")
+
+    report = {"environment": environment()}
+    # Stage output (progress prints from face_lock) goes to stderr; stdout carries only the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        crops = face_crops(args.face_data)
+        if "detect" in stages:
+            frames = read_frames(args.source, args.frames) if args.source else synthetic_frames(crops, args.frames)
+            report["detect"] = dict(bench_detect(frames), source=args.source or "synthetic")
+        if "predict" in stages:
+            sizes = [int(n) for n in args.people.split(",")]
+            report["predict"] = bench_predict(crops, sizes, args.samples, args.probes, args.lbph_max_people)
+        if "train" in stages:
+            report["train"] = bench_train(crops, args.train_people, args.samples)
+        if "attendance" in stages:
+            report["attendance"] = bench_attendance(args.scans, args.latency_ms / 1000)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
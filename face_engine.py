@@ -0,0 +1,258 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import face_lock
+from face_metrics import JOBS, STAGE_SECONDS
+from face_pipeline import open_frame_source
+
+# How long the camera stays open after the last job before it is released
+CAMERA_IDLE_TIMEOUT = 60
+# Finished jobs kept around for status polling
+MAX_FINISHED_JOBS = 200
+
+
+class Job:
+    """A register/verify request. State goes queued -> running -> done | error.
+    Every change bumps `version` so pollers can wait for the next change."""
+
+    def __init__(self, kind, args, env):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.args = args
+        self.env = env
+        self.state = "queued"
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.version = 0
+        self.changed = threading.Condition()
+        # Set to end a kiosk job; it then finishes normally with the people marked so far
+        self.cancelled = threading.Event()
+
+    @property
+    def key(self):
+        # Jobs with the same key are coalesced while one is still pending
+        return (self.kind, self.args[0]) if self.kind == "register" else (self.kind,)
+
+    def is_finished(self):
+        return self.state in ("done", "error")
+
+    def update(self, state, result=None, error=None):
+        with self.changed:
+            self.state = state
+            self.result = result
+            self.error = error
+            if self.is_finished():
+                self.finished = time.time()
+            self.version += 1
+            self.changed.notify_all()
+
+    def wait(self, since_version=None, timeout=None):
+        """Blocks until the job changes past since_version (or finishes when None). Returns a snapshot."""
+        with self.changed:
+            if since_version is None:
+                self.changed.wait_for(self.is_finished, timeout)
+            else:
+                self.changed.wait_for(lambda: self.version > since_version or self.is_finished(), timeout)
+            return self.to_dict()
+
+    def to_dict(self):
+        return {"job_id": self.id, "kind": self.kind, "state": self.state, "version": self.version,
+                "result": self.result, "error": self.error,
+                "created": self.created, "finished": self.finished}
+
+
+class RecognitionEngine:
+    """Resident face engine for the bridge. Keeps the LBPH model, Haar cascade and camera warm
+    and runs register/verify jobs one at a time on a single worker thread (OpenCV windows are not thread safe)."""
+
+    def __init__(self, camera_index=None, idle_timeout=CAMERA_IDLE_TIMEOUT):
+        self.camera_index = face_lock.CAMERA_INDEX if camera_index is None else camera_index
+        self.idle_timeout = idle_timeout
+        self.jobs = queue.Queue()
+        self.jobs_by_id = OrderedDict()
+        self.pending = {}  # job key -> queued/running job
+        self.lock = threading.Lock()
+        self.video_capture = None
+        self.id_map = None
+        self.recognize = None
+        self.model_stamp = None
+        self.journal = None
+        self.thread = threading.Thread(target=self._run, name="recognition-engine", daemon=True)
+
+    def start(self):
+        self.reload_if_changed()
+        # Starts syncing scans left in the journal by an earlier run
+        self.journal = face_lock.attendance_journal()
+        # Today's attendance loads in the background from now on, not when the first person is recognized
+        face_lock.today_attendance().seed()
+        self.thread.start()
+
+    def submit(self, kind, *args, env=None):
+        """Queues a 'register', 'verify' or 'kiosk' job and returns (job, coalesced).
+        A duplicate of a job that is still queued/running returns that job instead of starting another.
+        Any other job ends a kiosk job, which would otherwise hold the worker (and camera) forever.
+        env carries per-request Supabase credentials."""
+        job = Job(kind, args, env or {})
+        with self.lock:
+            existing = self.pending.get(job.key)
+            if existing is not None:
+                return existing, True
+            self.pending[job.key] = job
+            self.jobs_by_id[job.id] = job
+            self._prune()
+        self.jobs.put(job)
+        if kind != "kiosk":
+            self.stop_kiosk()
+        return job, False
+
+    def stop_kiosk(self):
+        """Ends the queued or running kiosk job as if 'q' was pressed. Returns that job, or None."""
+        with self.lock:
+            job = self.pending.get(("kiosk",))
+        if job is not None:
+            job.cancelled.set()
+        return job
+
+    def get_job(self, job_id):
+        with self.lock:
+            return self.jobs_by_id.get(job_id)
+
+    def _prune(self):
+        finished = [j for j in self.jobs_by_id.values() if j.is_finished()]
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs_by_id[job.id]
+
+    # --- Model -------------------------------------------------------------
+
+    def _files_stamp(self):
+        stamp = []
+        for path in (face_lock.TRAINER_FILE, face_lock.MAP_FILE, face_lock.MODEL_FILE):
+            stamp.append(os.path.getmtime(path) if os.path.exists(path) else None)
+        return tuple(stamp)
+
+    def model(self):
+        """(id_map, recognize) as one consistent pair for other threads (e.g. batch recognition on the
+        bridge), or (None, None) while no model is loaded or a registration is replacing it."""
+        with self.lock:
+            return self.id_map, self.recognize
+
+    def _publish(self, id_map, recognize):
+        with self.lock:
+            self.id_map, self.recognize = id_map, recognize
+
+    def reload_if_changed(self):
+        """Reloads the model only when its files' mtimes moved (e.g. a CLI 'train' ran)."""
+        stamp = self._files_stamp()
+        if stamp == self.model_stamp:
+            return
+        if face_lock.model_exists():
+            print("Loading face model...")
+            self._publish(*face_lock.load_model())
+        else:
+            self._publish(None, None)
+        self.model_stamp = stamp
+
+    def _republish(self):
+        """Publishes the model as registration left it (whether or not it succeeded)."""
+        try:
+            if not face_lock.model_exists():
+                self._publish(None, None)
+            elif face_lock.uses_model_file():
+                self._publish(*face_lock.load_model())
+            else:
+                # enroll_worker() updated the in-memory LBPH model; just pick up the new map
+                self._publish(face_lock.load_id_map(), face_lock.make_matcher())
+            self.model_stamp = self._files_stamp()
+        except Exception as e:
+            print(f"Engine: could not reload the face model: {e}")
+            self.model_stamp = None  # the next job tries again
+
+    # --- Camera ------------------------------------------------------------
+
+    def _camera(self):
+        if self.video_capture is None or not self.video_capture.isOpened():
+            with STAGE_SECONDS.time("camera_open"):
+                self.video_capture = open_frame_source(self.camera_index)
+        else:
+            # Drop frames that queued up in the driver buffer while idle
+            for _ in range(5):
+                self.video_capture.grab()
+        return self.video_capture
+
+    def _release_camera(self):
+        if self.video_capture is not None:
+            self.video_capture.release()
+            self.video_capture = None
+
+    # --- Worker ------------------------------------------------------------
+
+    def _run(self):
+        while True:
+            try:
+                job = self.jobs.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                self._release_camera()
+                continue
+            started = time.time()
+            job.update("running")
+            result, error = None, None
+            try:
+                result = self._execute(job)
+                print(f"Engine: {job.kind} job finished in {time.time() - started:.2f}s")
+            except Exception as e:
+                print(f"Engine: {job.kind} job failed: {e}")
+                error = str(e)
+            STAGE_SECONDS.observe(time.time() - started, job.kind)
+            JOBS.inc(job.kind, "error" if error else "done")
+            # Stop coalescing onto this job before anyone can observe it as finished
+            with self.lock:
+                if self.pending.get(job.key) is job:
+                    del self.pending[job.key]
+            job.update("error" if error else "done", result=result, error=error)
+            self.jobs.task_done()
+
+    def _execute(self, job):
+        self._apply_env(job.env)
+        self.reload_if_changed()
+        if job.kind == "register":
+            worker_id = job.args[0]
+            # Stop handing out the model while registration changes it: LBPH mode updates the shared
+            # recognizer in place, and Windows refuses to replace a single-file model.bin while it is mapped
+            self._publish(None, None)
+            try:
+                count = face_lock.register_face(*job.args, video_capture=self._camera())
+            finally:
+                # Also after a failed registration, or the model would stay unpublished
+                self._republish()
+            if not count:
+                raise RuntimeError("No usable face samples captured")
+            return {"worker_id": worker_id, "samples": count}
+        if job.kind == "verify":
+            if self.id_map is None:
+                match = face_lock.verify_and_mark_attendance()
+            else:
+                match = face_lock.verify_and_mark_attendance(video_capture=self._camera(), id_map=self.id_map,
+                                                             recognize=self.recognize)
+            if match is None:
+                return {"matched": False}
+            return dict(match, matched=True)
+        if job.kind == "kiosk":
+            if self.id_map is None:
+                marked = face_lock.scan_continuously(stop=job.cancelled)
+            else:
+                marked = face_lock.scan_continuously(video_capture=self._camera(), id_map=self.id_map,
+                                                     recognize=self.recognize, stop=job.cancelled)
+            return {"marked": marked}
+        raise ValueError(f"Unknown job kind: {job.kind}")
+
+    def _apply_env(self, env):
+        if env.get("VITE_SUPABASE_URL"):
+            face_lock.SUPABASE_URL = env["VITE_SUPABASE_URL"]
+        if env.get("VITE_SUPABASE_KEY"):
+            face_lock.SUPABASE_KEY = env["VITE_SUPABASE_KEY"]
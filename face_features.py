@@ -0,0 +1,131 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import cv2
+import numpy as np
+
+from face_gallery import lbp_histogram
+from face_store import HEADER_SIZE
+
+# Sample store rows per task when histograms are computed on the process pool
+STORE_CHUNK = 256
+
+# Per-folder cache of LBP histograms: one row per image in features.npy, and an index
+# {"params": {...}, "images": [[name, mtime_ns, size], ...]} in features.json (row i = images[i])
+CACHE_FILE = "features.npy"
+CACHE_INDEX = "features.json"
+
+
+def _read_cache(worker_path, params):
+    """Returns ({name: (mtime_ns, size, row)}, rows memmap) or ({}, None) when missing or stale."""
+    try:
+        with open(os.path.join(worker_path, CACHE_INDEX), "r") as f:
+            index = json.load(f)
+        if index.get("params") != params:
+            return {}, None
+        rows = np.load(os.path.join(worker_path, CACHE_FILE), mmap_mode="r")
+    except (OSError, ValueError):
+        return {}, None
+    images = index.get("images", [])
+    if len(images) != len(rows):
+        return {}, None
+    return {name: (mtime_ns, size, row) for row, (name, mtime_ns, size) in enumerate(images)}, rows
+
+
+def _write_cache(worker_path, params, images, histograms, bins):
+    index_path = os.path.join(worker_path, CACHE_INDEX)
+    cache_path = os.path.join(worker_path, CACHE_FILE)
+    # Drop the index first: a crash before the new one is written costs a recompute, never a mismatch
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    rows = np.stack(histograms) if histograms else np.zeros((0, bins), dtype=np.float32)
+    with open(cache_path + ".tmp", "wb") as f:
+        np.save(f, rows)
+    os.replace(cache_path + ".tmp", cache_path)
+    with open(index_path + ".tmp", "w") as f:
+        json.dump({"params": params, "images": images}, f)
+    os.replace(index_path + ".tmp", index_path)
+
+
+def update_worker_features(worker_path, params):
+    """Brings a worker folder's feature cache up to date with its .jpg crops and returns the number of
+    histograms in it. Only images that are new or changed (by mtime and size) are decoded."""
+    cached, rows = _read_cache(worker_path, params)
+    bins = 2 ** params["neighbors"] * params["grid_x"] * params["grid_y"]
+    images, histograms, changed = [], [], False
+    for name in sorted(os.listdir(worker_path)):
+        if not name.endswith(".jpg"): continue
+        path = os.path.join(worker_path, name)
+        stat = os.stat(path)
+        entry = cached.get(name)
+        if entry and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+            histograms.append(np.array(rows[entry[2]]))
+        else:
+            img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+            if img is None: continue
+            histograms.append(lbp_histogram(img, **params))
+            changed = True
+        images.append([name, stat.st_mtime_ns, stat.st_size])
+    del rows  # release the mapping before the file is replaced (Windows refuses otherwise)
+    if changed or len(images) != len(cached):
+        _write_cache(worker_path, params, images, histograms, bins)
+    return len(images)
+
+
+def load_worker_features(worker_path):
+    """The cached (count x bins) histograms of a worker folder, memory-mapped read-only."""
+    return np.load(os.path.join(worker_path, CACHE_FILE), mmap_mode="r")
+
+
+def update_features(worker_paths, params, processes=None):
+    """Runs update_worker_features() for many folders, spread over a process pool.
+    Yields (worker_path, count) in the given order. Only counts cross process boundaries; the
+    histograms stay in each folder's cache, so memory does not grow with the number of people."""
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(worker_paths) < 2:
+        for worker_path in worker_paths:
+            yield worker_path, update_worker_features(worker_path, params)
+        return
+    chunksize = max(1, len(worker_paths) // (processes * 4))
+    with ProcessPoolExecutor(processes) as pool:
+        counts = pool.map(update_worker_features, worker_paths, repeat(params), chunksize=chunksize)
+        yield from zip(worker_paths, counts)
+
+
+def _store_histograms(path, size, start, stop, params):
+    rows = np.memmap(path, dtype=np.uint8, mode="r", offset=HEADER_SIZE + start * size * size,
+                     shape=(stop - start, size, size))
+    return np.stack([lbp_histogram(row, **params) for row in rows]).astype(np.float32, copy=False)
+
+
+def update_store_features(store, params, processes=None):
+    """Brings a SampleStore's features file up to date and returns it as a read-only (rows x bins)
+    memory map, row i being the histogram of sample i. Samples never change once written, so only
+    rows appended since the last call are computed (all of them when params changed)."""
+    bins = 2 ** params["neighbors"] * params["grid_x"] * params["grid_y"]
+    done = store.features["rows"] if store.features and store.features.get("params") == params else 0
+    # The file may be shorter than the index says (deleted, not copied along, or cut short by a crash)
+    on_disk = os.path.getsize(store.features_path) // (bins * 4) if os.path.exists(store.features_path) else 0
+    done = min(done, store.records, on_disk)
+    if done < store.records or not os.path.exists(store.features_path):
+        starts = range(done, store.records, STORE_CHUNK)
+        stops = [min(start + STORE_CHUNK, store.records) for start in starts]
+        processes = processes or os.cpu_count() or 1
+        with open(store.features_path, "ab") as f:
+            f.truncate(done * bins * 4)  # rows past `done` are stale or half-written
+            if processes == 1 or len(starts) < 2:
+                chunks = map(_store_histograms, repeat(store.path), repeat(store.size), starts, stops, repeat(params))
+                for chunk in chunks:
+                    f.write(chunk.tobytes())
+            else:
+                with ProcessPoolExecutor(min(processes, len(starts))) as pool:
+                    for chunk in pool.map(_store_histograms, repeat(store.path), repeat(store.size), starts, stops,
+                                          repeat(params)):
+                        f.write(chunk.tobytes())
+        store.features = {"params": params, "rows": store.records}
+        store.save_index()
+    if not store.records:
+        return np.zeros((0, bins), dtype=np.float32)
+    return np.memmap(store.features_path, dtype=np.float32, mode="r", shape=(store.records, bins))
@@ -0,0 +1,406 @@
+import json
+import os
+import struct
+
+import cv2
+import numpy as np
+
+# Histogram bins processed per step; bounds the temporary (bins x gallery) array
+CHUNK_BINS = 64
+# Histograms buffered by write_gallery_chunks() before they are transposed into the file
+WRITE_ROWS = 1024
+
+
+def lbp_histogram(gray, radius=1, neighbors=8, grid_x=8, grid_y=8):
+    """Spatial LBP histogram of a grayscale face crop, computed the same way as OpenCV's LBPH
+    (circular LBP with bilinear sampling, per-cell histograms normalized by cell size)."""
+    src = np.asarray(gray, dtype=np.float32)
+    rows, cols = src.shape[0] - 2 * radius, src.shape[1] - 2 * radius
+    center = src[radius:radius + rows, radius:radius + cols]
+    codes = np.zeros((rows, cols), dtype=np.int32)
+
+    for n in range(neighbors):
+        # Angles in double precision, sample offsets and weights in float32, as in OpenCV's elbp()
+        x = np.float32(radius * np.cos(2.0 * np.pi * n / neighbors))
+        y = np.float32(-radius * np.sin(2.0 * np.pi * n / neighbors))
+        fx, fy = int(np.floor(x)), int(np.floor(y))
+        cx, cy = int(np.ceil(x)), int(np.ceil(y))
+        ty, tx = np.float32(y - fy), np.float32(x - fx)
+        w1 = (1 - tx) * (1 - ty)
+        w2 = tx * (1 - ty)
+        w3 = (1 - tx) * ty
+        w4 = tx * ty
+
+        def shifted(dy, dx):
+            return src[radius + dy:radius + dy + rows, radius + dx:radius + dx + cols]
+
+        t = w1 * shifted(fy, fx) + w2 * shifted(fy, cx) + w3 * shifted(cy, fx) + w4 * shifted(cy, cx)
+        hit = (t > center) | (np.abs(t - center) < np.finfo(np.float32).eps)
+        codes += hit.astype(np.int32) << n
+
+    bins = 2 ** neighbors
+    height, width = rows // grid_y, cols // grid_x
+    if height == 0 or width == 0:
+        return np.zeros(grid_y * grid_x * bins, dtype=np.float32)
+    # Cell index for every pixel inside the grid, then one bincount for all cells
+    cells = codes[:grid_y * height, :grid_x * width].reshape(grid_y, height, grid_x, width)
+    cell_ids = (np.arange(grid_y)[:, None, None, None] * grid_x + np.arange(grid_x)[None, None, :, None])
+    flat = (np.broadcast_to(cell_ids, cells.shape) * bins + cells).ravel()
+    hist = np.bincount(flat, minlength=grid_y * grid_x * bins).astype(np.float32)
+    return hist / np.float32(height * width)
+
+
+def chi_square(probes, gallery_t, gallery_sums=None):
+    """OpenCV HISTCMP_CHISQR_ALT distance between every probe and every gallery histogram.
+
+    gallery_t is the gallery transposed to (bins x entries), so one bin across all entries is a
+    contiguous row. Uses (p - g)^2 / (p + g) == p + g - 4pg / (p + g): bins where the probe is zero
+    contribute exactly g, so only the probe's non-zero bins are visited. Returns (probes x entries).
+    """
+    probes = np.atleast_2d(probes).astype(np.float32, copy=False)
+    if gallery_sums is None:
+        gallery_sums = gallery_t.sum(axis=0)
+    cross = np.zeros((len(probes), gallery_t.shape[1]), dtype=np.float32)
+    for k, probe in enumerate(probes):
+        support = np.flatnonzero(probe)
+        for start in range(0, len(support), CHUNK_BINS):
+            bins = support[start:start + CHUNK_BINS]
+            g = gallery_t[bins]
+            p = probe[bins][:, None]
+            den = g + p
+            g *= p
+            g /= den
+            cross[k] += g.sum(axis=0)
+    distances = 2.0 * (probes.sum(axis=1)[:, None] + gallery_sums[None, :] - 4.0 * cross)
+    # The rearranged sum can dip a hair below zero for identical histograms
+    return np.maximum(distances, 0.0)
+
+
+class GalleryMatcher:
+    """Batched replacement for LBPH predict(): all training histograms live in contiguous float32
+    matrices (stored bins x entries) and every face in a frame is scored against them in one call.
+
+    The gallery is a list of segments (gallery_t, labels, sums). An in-memory gallery has one; a
+    model file opened with load_gallery() has one per append, each a read-only memory map.
+
+    With prototypes=True each person is reduced to the mean of their histograms, so cost grows
+    with headcount instead of sample count. Distances stay on the LBPH scale (same histograms,
+    same chi-square), so the usual < 75 threshold applies; prototype distances run a little lower
+    than nearest-sample ones.
+    """
+
+    def __init__(self, histograms, labels, radius=1, neighbors=8, grid_x=8, grid_y=8, prototypes=False):
+        histograms = np.ascontiguousarray(histograms, dtype=np.float32)
+        labels = np.asarray(labels, dtype=np.int32).ravel()
+        segment = (np.ascontiguousarray(histograms.T), labels, histograms.sum(axis=1))
+        self._setup([segment], {"radius": radius, "neighbors": neighbors, "grid_x": grid_x, "grid_y": grid_y},
+                    prototypes)
+
+    @classmethod
+    def from_segments(cls, segments, params, prototypes=False, id_map=None):
+        matcher = cls.__new__(cls)
+        matcher._setup(segments, params, prototypes)
+        matcher.id_map = id_map
+        return matcher
+
+    @classmethod
+    def from_recognizer(cls, recognizer, prototypes=False):
+        """Builds the gallery from a trained cv2 LBPH recognizer."""
+        histograms = recognizer.getHistograms()
+        histograms = np.vstack(histograms) if len(histograms) else np.zeros((0, 0), np.float32)
+        return cls(histograms, recognizer.getLabels(), recognizer.getRadius(), recognizer.getNeighbors(),
+                   recognizer.getGridX(), recognizer.getGridY(), prototypes)
+
+    def _setup(self, segments, params, prototypes):
+        self.params = params
+        self.id_map = None
+        segments = [segment for segment in segments if len(segment[1])]
+        if prototypes and segments:
+            segments = [_prototype_segment(segments)]
+        self.segments = segments
+
+    def __len__(self):
+        return sum(len(labels) for _, labels, _ in self.segments)
+
+    def predict_histograms(self, probes):
+        """Returns (labels, distances) of the nearest gallery entry for each probe histogram."""
+        best_labels = np.full(len(probes), -1, dtype=np.int32)
+        best_distances = np.full(len(probes), np.finfo(np.float32).max, dtype=np.float32)
+        for gallery_t, labels, sums in self.segments:
+            distances = chi_square(probes, gallery_t, sums)
+            nearest = distances.argmin(axis=1)
+            nearest_distances = distances[np.arange(len(probes)), nearest]
+            better = nearest_distances < best_distances
+            best_labels[better] = labels[nearest[better]]
+            best_distances[better] = nearest_distances[better]
+        return best_labels, best_distances
+
+    def __call__(self, gray, faces):
+        """Same contract as face_lock.recognize_faces: [((x, y, w, h), label, distance)]."""
+        faces = [tuple(int(v) for v in face) for face in faces]
+        if not faces:
+            return []
+        probes = np.stack([lbp_histogram(gray[y:y+h, x:x+w], **self.params) for (x, y, w, h) in faces])
+        labels, distances = self.predict_histograms(probes)
+        return [(face, int(label), float(distance)) for face, label, distance in zip(faces, labels, distances)]
+
+
+def _prototype_segment(segments):
+    """Collapses all segments into one holding the mean histogram of each label."""
+    totals, counts = {}, {}
+    for gallery_t, labels, _ in segments:
+        for label in np.unique(labels):
+            columns = gallery_t[:, labels == label]
+            totals[label] = totals.get(label, 0) + columns.sum(axis=1, dtype=np.float64)
+            counts[label] = counts.get(label, 0) + columns.shape[1]
+    unique = np.array(sorted(totals), dtype=np.int32)
+    gallery_t = np.ascontiguousarray(np.stack([totals[l] / counts[l] for l in unique], axis=1), dtype=np.float32)
+    return gallery_t, unique, gallery_t.sum(axis=0)
+
+
+# --- Binary model file ---------------------------------------------------------
+#
+# [file header, 64 bytes]  magic, format version, radius, neighbors, grid_x, grid_y, bins
+# then one or more segments, each:
+# [segment header, 64 bytes] magic, entry count, meta length
+# [meta]                     JSON {"id_map": {...}} for the labels added by this segment
+# [labels]                   int32[count]
+# [sums]                     float32[count]     row sums of the histograms
+# [histograms]               float32[bins, count] transposed, ready for chi_square()
+# Every block starts on a 64-byte boundary so the arrays can be viewed straight out of the map.
+# Enrolling appends a segment; a full rebuild writes a new file as a single segment.
+#
+# A full rebuild never replaces a file that scanners may have mapped (Windows refuses that). It
+# writes the next version next to the model path (model.bin -> model.<n>.bin) and then swaps in
+# the model path itself as a small pointer file: POINTER_MAGIC followed by the version's file name.
+# A model path that holds the gallery itself (written before versioning) is read as it is.
+
+GALLERY_MAGIC = b"HMSGALRY"
+SEGMENT_MAGIC = b"HMSSEGMT"
+POINTER_MAGIC = b"HMSGPNTR"
+GALLERY_VERSION = 1
+ALIGN = 64
+FILE_HEADER = struct.Struct("<8sIIIIII")
+SEGMENT_HEADER = struct.Struct("<8sII")
+
+
+def _padded(size):
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _write_block(f, data):
+    f.write(data)
+    f.write(b"\0" * (_padded(len(data)) - len(data)))
+
+
+def _write_segment(f, histograms, labels, id_map_entries, bins):
+    """Writes one segment; histograms is (count x bins) and is transposed in bin chunks."""
+    labels = np.asarray(labels, dtype=np.int32).ravel()
+    meta = json.dumps({"id_map": id_map_entries}).encode()
+    _write_block(f, SEGMENT_HEADER.pack(SEGMENT_MAGIC, len(labels), len(meta)))
+    _write_block(f, meta)
+    _write_block(f, labels.tobytes())
+    sums = np.array([np.float32(h.sum()) for h in histograms], dtype=np.float32)
+    _write_block(f, sums.tobytes())
+    written = 0
+    for start in range(0, bins, 1024):
+        rows = np.stack([np.ravel(h)[start:start + 1024] for h in histograms], axis=1) if len(labels) \
+            else np.zeros((0, 0), np.float32)
+        data = np.ascontiguousarray(rows, dtype=np.float32).tobytes()
+        f.write(data)
+        written += len(data)
+    f.write(b"\0" * (_padded(written) - written))
+
+
+def _read_segments(data):
+    """Yields (end_offset, segment, id_map_entries) for each complete segment after the file header."""
+    bins = FILE_HEADER.unpack_from(data, 0)[6]
+    offset = ALIGN
+    while offset + ALIGN <= len(data):
+        magic, count, meta_len = SEGMENT_HEADER.unpack_from(data, offset)
+        if magic != SEGMENT_MAGIC:
+            break
+        meta_at = offset + ALIGN
+        labels_at = meta_at + _padded(meta_len)
+        sums_at = labels_at + _padded(4 * count)
+        hist_at = sums_at + _padded(4 * count)
+        end = hist_at + _padded(4 * count * bins)
+        if end > len(data):
+            break  # segment cut short by an interrupted append
+        meta = json.loads(bytes(data[meta_at:meta_at + meta_len]))
+        labels = data[labels_at:labels_at + 4 * count].view(np.int32)
+        sums = data[sums_at:sums_at + 4 * count].view(np.float32)
+        gallery_t = data[hist_at:hist_at + 4 * count * bins].view(np.float32).reshape(bins, count)
+        yield end, (gallery_t, labels, sums), meta.get("id_map", {})
+        offset = end
+
+
+def _read_header(data, path):
+    if len(data) < ALIGN:
+        raise ValueError(f"{path} is not a face gallery file")
+    magic, version, radius, neighbors, grid_x, grid_y, bins = FILE_HEADER.unpack_from(data, 0)
+    if magic != GALLERY_MAGIC:
+        raise ValueError(f"{path} is not a face gallery file")
+    if version != GALLERY_VERSION:
+        raise ValueError(f"{path} has gallery format version {version}, expected {GALLERY_VERSION}")
+    return {"radius": radius, "neighbors": neighbors, "grid_x": grid_x, "grid_y": grid_y}, bins
+
+
+def gallery_file(path):
+    """The file that holds the gallery of the model path: the version its pointer names, or path itself."""
+    with open(path, "rb") as f:
+        head = f.read(len(POINTER_MAGIC) + 255)
+    if head.startswith(POINTER_MAGIC):
+        return os.path.join(os.path.dirname(path), head[len(POINTER_MAGIC):].decode())
+    return path
+
+
+def _versions(path):
+    """Version numbers of the model.<n>.bin files next to path."""
+    stem, ext = os.path.splitext(os.path.basename(path))
+    versions = []
+    for name in os.listdir(os.path.dirname(path) or "."):
+        number = name[len(stem) + 1:len(name) - len(ext)]
+        if name.startswith(stem + ".") and name.endswith(ext) and number.isdigit():
+            versions.append(int(number))
+    return versions
+
+
+def write_gallery(path, histograms, labels, id_map, params):
+    """Writes a complete model as a new version (one segment) and points path at it. Older versions
+    are deleted, except those a scanner still has mapped on Windows; a later rebuild retries them."""
+    _write_version(path, params, lambda f, bins: _write_segment(f, histograms, labels, id_map, bins))
+
+
+def write_gallery_chunks(path, chunks, labels, id_map, params):
+    """write_gallery() for histograms that arrive as an iterable of (rows x bins) arrays, e.g. one
+    memory-mapped feature cache per person: each chunk is copied into a small buffer and can be
+    closed before the next one is opened. The chunks must hold len(labels) rows in all."""
+    labels = np.asarray(labels, dtype=np.int32).ravel()
+
+    def write(f, bins):
+        meta = json.dumps({"id_map": id_map}).encode()
+        _write_block(f, SEGMENT_HEADER.pack(SEGMENT_MAGIC, len(labels), len(meta)))
+        _write_block(f, meta)
+        _write_block(f, labels.tobytes())
+        sums_at = f.tell()
+        hist_at = sums_at + _padded(4 * len(labels))
+        end = hist_at + _padded(4 * len(labels) * bins)
+        f.truncate(end)
+        f.seek(end)
+        if not len(labels):
+            return
+        f.flush()
+        sums = np.memmap(f, dtype=np.float32, mode="r+", offset=sums_at, shape=(len(labels),))
+        gallery_t = np.memmap(f, dtype=np.float32, mode="r+", offset=hist_at, shape=(bins, len(labels)))
+        position, buffered = 0, []
+
+        def write_buffer():
+            rows = np.concatenate(buffered)
+            gallery_t[:, position:position + len(rows)] = rows.T
+            sums[position:position + len(rows)] = rows.sum(axis=1)
+            return position + len(rows)
+
+        for chunk in chunks:
+            buffered.append(np.array(chunk, dtype=np.float32).reshape(-1, bins))
+            if sum(len(rows) for rows in buffered) >= WRITE_ROWS:
+                position, buffered = write_buffer(), []
+        if buffered:
+            position = write_buffer()
+        if position != len(labels):
+            raise ValueError(f"Got {position} histograms for {len(labels)} labels")
+        gallery_t.flush()
+        sums.flush()
+        del gallery_t, sums
+
+    _write_version(path, params, write)
+
+
+def _write_version(path, params, write_segment):
+    bins = 2 ** params["neighbors"] * params["grid_x"] * params["grid_y"]
+    stem, ext = os.path.splitext(path)
+    old_versions = _versions(path)
+    data_path = f"{stem}.{max(old_versions, default=0) + 1}{ext}"
+    with open(data_path + ".tmp", "w+b") as f:
+        _write_block(f, FILE_HEADER.pack(GALLERY_MAGIC, GALLERY_VERSION, params["radius"], params["neighbors"],
+                                         params["grid_x"], params["grid_y"], bins))
+        write_segment(f, bins)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(data_path + ".tmp", data_path)
+    with open(path + ".tmp", "wb") as f:
+        f.write(POINTER_MAGIC + os.path.basename(data_path).encode())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    for version in old_versions:
+        try:
+            os.remove(f"{stem}.{version}{ext}")
+        except OSError:
+            pass
+
+
+def write_lbph_model(path, histograms, labels, params):
+    """Writes histograms in OpenCV's LBPHFaceRecognizer YAML format (trainer.yml), so recognizer.read()
+    loads them without retraining from the images."""
+    fs = cv2.FileStorage(path, cv2.FILE_STORAGE_WRITE)
+    fs.startWriteStruct("opencv_lbphfaces", cv2.FileNode_MAP)
+    fs.write("threshold", float(np.finfo(np.float64).max))
+    for key in ("radius", "neighbors", "grid_x", "grid_y"):
+        fs.write(key, int(params[key]))
+    fs.startWriteStruct("histograms", cv2.FileNode_SEQ)
+    for histogram in histograms:
+        fs.write("", np.asarray(histogram, dtype=np.float32).reshape(1, -1))
+    fs.endWriteStruct()
+    fs.write("labels", np.asarray(labels, dtype=np.int32).reshape(-1, 1))
+    fs.startWriteStruct("labelsInfo", cv2.FileNode_SEQ)
+    fs.endWriteStruct()
+    fs.endWriteStruct()
+    fs.release()
+
+
+def append_gallery(path, histograms, labels, id_map_entries):
+    """Appends one segment (e.g. a newly enrolled person). Cost depends only on the new samples.
+    Processes that already mapped the file keep seeing the old segments until they reopen it."""
+    model_path, path = path, gallery_file(path)
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    _, bins = _read_header(data, path)
+    valid_end = ALIGN
+    for valid_end, _, _ in _read_segments(data):
+        pass
+    del data
+    with open(path, "r+b") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() != valid_end:
+            f.truncate(valid_end)  # drop a half-written tail
+        f.seek(valid_end)
+        _write_segment(f, histograms, labels, id_map_entries, bins)
+        f.flush()
+        os.fsync(f.fileno())
+    if model_path != path:
+        os.utime(model_path)  # the model path's mtime tells readers the model changed
+
+
+def load_gallery(path, prototypes=False):
+    """Opens a model file as a read-only memory map; nothing is parsed or copied beyond the headers,
+    so several scanner processes share the same pages. The merged id map is on matcher.id_map."""
+    for attempt in range(3):
+        try:
+            data = np.memmap(gallery_file(path), dtype=np.uint8, mode="r")
+            break
+        except FileNotFoundError:
+            if attempt == 2 or not os.path.exists(path):
+                raise  # else a rebuild deleted the version between reading the pointer and opening it
+    params, _ = _read_header(data, path)
+    segments, id_map = [], {}
+    for _, segment, entries in _read_segments(data):
+        segments.append(segment)
+        id_map.update(entries)
+    if len(segments) > 2:
+        # Segments appended by enrollments are small; one in-memory copy of them keeps matching
+        # to two passes however many people enrolled since the last full rebuild
+        tail = segments[1:]
+        segments = [segments[0], (np.concatenate([g for g, _, _ in tail], axis=1),
+                                  np.concatenate([l for _, l, _ in tail]),
+                                  np.concatenate([s for _, _, s in tail]))]
+    return GalleryMatcher.from_segments(segments, params, prototypes, id_map)
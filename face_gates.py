@@ -0,0 +1,142 @@
+import os
+import threading
+from contextlib import ExitStack
+
+import cv2
+
+from face_metrics import FRAMES, GATE_FRAMES
+from face_pipeline import FaceDetector, process_frame, single_threaded_opencv
+
+CASCADE_FILE = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+
+
+class GateStream:
+    """One camera of a MultiGateScanner. Holds at most one frame waiting for a worker, so a gate
+    that produces frames faster than it is served never builds a backlog."""
+
+    def __init__(self, name, source):
+        self.name = name
+        self.source = source
+        self.live = getattr(source, "live", True)
+        # Each stream has its own detector: its tracking state belongs to this camera
+        self.detector = FaceDetector(cv2.CascadeClassifier(CASCADE_FILE), 1.2, 5)
+        self.pending = None  # (index, frame) waiting for a worker
+        self.busy = False
+        self.ended = False
+        self.last_result = None
+        self.frames_captured = 0
+        self.frames_processed = 0
+        self.frames_dropped = 0
+
+
+class MultiGateScanner:
+    """Scans several cameras from one process over one shared, read-only gallery.
+
+    Each stream has a capture thread that keeps only its newest frame (finite sources wait for the
+    frame to be taken instead, so none is skipped). A pool of worker threads runs detection and
+    recognition (see face_pipeline.process_frame). Workers take streams in round-robin order and
+    never two frames of the same stream at once, so every gate gets a turn before a busy one gets
+    another. on_frame(stream, RecognizedFrame) runs on the worker thread.
+    """
+
+    def __init__(self, sources, recognize, on_frame, workers=None):
+        self.streams = [GateStream(name, source) for name, source in sources.items()]
+        self.recognize = recognize
+        self.on_frame = on_frame
+        self.workers = workers or min(os.cpu_count() or 1, len(self.streams))
+        self.turn = 0
+        self.changed = threading.Condition()
+        self.stopped = False
+        self.cleanup = ExitStack()
+        self.threads = [threading.Thread(target=self._capture_loop, args=(stream,), name=f"gate-capture-{stream.name}",
+                                         daemon=True) for stream in self.streams]
+        self.threads += [threading.Thread(target=self._worker_loop, name=f"gate-worker-{i}", daemon=True)
+                         for i in range(self.workers)]
+
+    def start(self):
+        if self.workers > 1:
+            self.cleanup.enter_context(single_threaded_opencv())
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        with self.changed:
+            self.stopped = True
+            self.changed.notify_all()
+        for thread in self.threads:
+            thread.join(timeout=1)
+        self.cleanup.close()
+
+    def wait(self, timeout=None):
+        """Blocks until every stream has ended and its frames are processed (live cameras don't end)."""
+        with self.changed:
+            return self.changed.wait_for(self._finished, timeout)
+
+    def stats(self):
+        return {stream.name: {"captured": stream.frames_captured, "processed": stream.frames_processed,
+                              "dropped": stream.frames_dropped, "ended": stream.ended} for stream in self.streams}
+
+    def _finished(self):
+        return self.stopped or all(s.ended and s.pending is None and not s.busy for s in self.streams)
+
+    def _capture_loop(self, stream):
+        index = 0
+        while True:
+            ret, frame = stream.source.read()
+            with self.changed:
+                if self.stopped:
+                    return
+                if not ret:
+                    stream.ended = True
+                    self.changed.notify_all()
+                    return
+                stream.frames_captured += 1
+                if not stream.live:
+                    self.changed.wait_for(lambda: stream.pending is None or self.stopped)
+                elif stream.pending is not None:
+                    stream.frames_dropped += 1
+                    FRAMES.inc("dropped")
+                    GATE_FRAMES.inc(stream.name, "dropped")
+                stream.pending = (index, frame)
+                index += 1
+                self.changed.notify_all()
+
+    def _next_work(self):
+        """Round robin over streams with a waiting frame that no other worker is serving."""
+        count = len(self.streams)
+        for offset in range(count):
+            stream = self.streams[(self.turn + offset) % count]
+            if stream.pending is not None and not stream.busy:
+                self.turn = (self.turn + offset + 1) % count
+                item, stream.pending, stream.busy = stream.pending, None, True
+                self.changed.notify_all()  # a finite source can read its next frame now
+                return stream, item
+        return None
+
+    def _worker_loop(self):
+        while True:
+            with self.changed:
+                work = None
+                while work is None:
+                    if self._finished():
+                        return
+                    work = self._next_work()
+                    if work is None:
+                        self.changed.wait()
+            stream, (index, frame) = work
+            try:
+                self._process(stream, index, frame)
+            except Exception as e:
+                print(f"Gate {stream.name}: frame {index} failed: {e}")
+            finally:
+                with self.changed:
+                    stream.busy = False
+                    self.changed.notify_all()
+
+    def _process(self, stream, index, frame):
+        result = process_frame(stream.detector, self.recognize, index, frame)
+        stream.last_result = result
+        stream.frames_processed += 1
+        GATE_FRAMES.inc(stream.name, "processed")
+        self.on_frame(stream, result)
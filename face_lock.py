@@ -3,7 +3,25 @@ import os
 import numpy as np
 import requests
 import json
-from datetime import datetime
+import queue
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timedelta
+
+from attendance_export import export as export_hours
+from attendance_journal import AttendanceJournal
+from attendance_state import CHECKED_IN, CHECKED_OUT, TodayAttendance
+from face_batch import BatchRecognizer, folder_frames, video_frames
+from face_gates import MultiGateScanner
+from face_features import load_worker_features, update_features, update_store_features, update_worker_features
+from face_gallery import (GalleryMatcher, append_gallery, load_gallery, write_gallery, write_gallery_chunks,
+                          write_lbph_model)
+from face_metrics import (ENABLED as METRICS_ENABLED, HTTP_REQUESTS, HTTP_SECONDS, RECOGNITIONS, STAGE_SECONDS,
+                          timed_stage)
+from face_pipeline import END_OF_STREAM, FaceDetector, FramePipeline, open_frame_source
+from face_samples import MAX_CAPTURE_SECONDS, MIN_CAPTURE_SECONDS, SamplePool, save_samples
+from face_store import SampleStore, pack_folders
 
 # Helper to read .env file
 def load_env():
@@ -24,6 +42,20 @@ SUPABASE_KEY = os.environ.get("VITE_SUPABASE_KEY", env.get("VITE_SUPABASE_KEY",
 FACE_DATA_DIR = "face_data"
 TRAINER_FILE = os.path.join(FACE_DATA_DIR, "trainer.yml")
 MAP_FILE = os.path.join(FACE_DATA_DIR, "id_map.json")
+# Binary, memory-mappable model (histograms + labels + id map), see face_gallery.py
+MODEL_FILE = os.path.join(FACE_DATA_DIR, "model.bin")
+# Local write-behind log of scans waiting to be synced to Supabase
+JOURNAL_FILE = os.path.join(FACE_DATA_DIR, "attendance_journal.db")
+# auto: model.bin with the gallery matcher when it exists, else trainer.yml with LBPH
+# lbph: OpenCV predict() per face | gallery: batched NumPy matcher | prototype: one mean histogram per person
+MATCHER = os.environ.get("FACE_MATCHER", env.get("FACE_MATCHER", "auto"))
+CAMERA_INDEX = int(os.environ.get("FACE_CAMERA_INDEX", env.get("FACE_CAMERA_INDEX", "0")))
+# Seconds during which a person who was just marked is not marked again
+SCAN_COOLDOWN = int(os.environ.get("FACE_SCAN_COOLDOWN", env.get("FACE_SCAN_COOLDOWN", "60")))
+# Seconds a person's status stays on screen in continuous mode
+OVERLAY_SECONDS = 4
+# (connect, read) seconds for every Supabase request; a hung connection then fails like any outage
+HTTP_TIMEOUT = (5, float(os.environ.get("FACE_HTTP_TIMEOUT", env.get("FACE_HTTP_TIMEOUT", "15"))))
 
 if not os.path.exists(FACE_DATA_DIR):
     os.makedirs(FACE_DATA_DIR)
@@ -38,29 +70,35 @@ except AttributeError:
 
 face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
 
-def register_face(worker_id, worker_name, user_type="worker"):
-    """Captures 30 photos for a worker to train the model. Saves metadata."""
-    video_capture = cv2.VideoCapture(0)
+def register_face(worker_id, worker_name, user_type="worker", video_capture=None):
+    """Captures face photos for a worker to train the model. Saves metadata. Returns the number saved.
+    Every detected face is scored (face_samples.py); only the best, mutually different crops are kept,
+    and they are written on a background thread.
+    Pass an open video_capture to reuse a pooled camera; it is left open for the caller."""
+    owns_camera = video_capture is None
+    if owns_camera:
+        video_capture = cv2.VideoCapture(CAMERA_INDEX)
     print(f"Registering face for {worker_name} ({user_type}). Look at the camera.")
     
     count = 0
-    # Create subfolder for worker
-    worker_path = os.path.join(FACE_DATA_DIR, str(worker_id))
-    if not os.path.exists(worker_path):
-        os.makedirs(worker_path)
-    
-    # Save metadata (name, type) in a JSON file inside the folder
     meta = {"name": worker_name, "type": user_type, "id": worker_id}
-    with open(os.path.join(worker_path, "meta.json"), "w") as f:
-        json.dump(meta, f)
+    # With a packed sample store the crops and metadata go there instead of a folder
+    store = sample_store()
+    worker_path = os.path.join(FACE_DATA_DIR, str(worker_id))
+    if store is None:
+        # Create subfolder for worker
+        if not os.path.exists(worker_path):
+            os.makedirs(worker_path)
+
+        # Save metadata (name, type) in a JSON file inside the folder
+        with open(os.path.join(worker_path, "meta.json"), "w") as f:
+            json.dump(meta, f)
 
     window_name = 'Face Registration - Stay Still'
     cv2.namedWindow(window_name, cv2.WINDOW_AUTOSIZE)
     cv2.setWindowProperty(window_name, cv2.WND_PROP_TOPMOST, 1)
 
     import time
-    last_capture_time = 0
-    capture_interval = 0.2 # Capture every 200ms (5 photos per sec)
     
     # 1. Show Instructions first
     instruction_start = time.time()
@@ -82,57 +120,68 @@ def register_face(worker_id, worker_name, user_type="worker"):
         cv2.putText(frame, f"Starting in {countdown}...", (220, 380), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 165, 255), 3)
         
         cv2.imshow(window_name, frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'): return
+        if cv2.waitKey(1) & 0xFF == ord('q'): return 0
 
     # 2. Start Capture
+    # Faces under 100x100 are never kept, so the detector doesn't look for them
+    detector = FaceDetector(face_cascade, 1.3, 5, min_size=(100, 100))
+    pool = SamplePool()
+    capture_start = None
+    aborted = False
     while True:
         ret, frame = video_capture.read()
         if not ret: break
         
         current_time = time.time()
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, 1.3, 5)
+        faces = detector(gray)
         
         for (x, y, w, h) in faces:
-            # Only capture if interval has passed AND face is large enough (min 100x100)
-            if current_time - last_capture_time > capture_interval and w > 100 and h > 100:
-                count += 1
-                last_capture_time = current_time
-                # Save the captured image into the datasets folder (keep gray for training)
-                file_name_path = os.path.join(worker_path, f"{count}.jpg")
-                cv2.imwrite(file_name_path, gray[y:y+h, x:x+w])
-                print(f"Captured {count}/30...")
+            # Offer every face that is large enough (min 100x100); the pool keeps the best ones
+            if w > 100 and h > 100:
+                if capture_start is None:
+                    capture_start = current_time
+                if pool.offer(gray[y:y+h, x:x+w]) and min(len(pool), pool.target) != count:
+                    count = min(len(pool), pool.target)
+                    print(f"Captured {count}/{pool.target}...")
             
             # Visual feedback
             cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
-            progress = int((count / 30) * 100)
-            cv2.putText(frame, f"Capturing: {count}/30 ({progress}%)", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+            progress = int((count / pool.target) * 100)
+            cv2.putText(frame, f"Capturing: {count}/{pool.target} ({progress}%)", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
             cv2.putText(frame, "Move your head slowly...", (50, 450), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
             
         cv2.imshow('Face Registration - Stay Still', frame)
         
         # Aggressive "Bring to Front" - retry for first few frames
         if count <= 5:
-            try:
-                import ctypes
-                hwnd = ctypes.windll.user32.FindWindowW(None, 'Face Registration - Stay Still')
-                if hwnd:
-                    # HWND_TOPMOST (-1), SWP_NOMOVE (0x2), SWP_NOSIZE (0x1), SWP_SHOWWINDOW (0x40)
-                    ctypes.windll.user32.SetWindowPos(hwnd, -1, 0, 0, 0, 0, 0x0001 | 0x0002 | 0x0040)
-                    ctypes.windll.user32.SetForegroundWindow(hwnd)
-                    ctypes.windll.user32.SetActiveWindow(hwnd)
-                    # Force window focus even if calling process is not foreground
-                    ctypes.windll.user32.ShowWindow(hwnd, 5) # SW_SHOW
-            except:
-                pass
-
-        if cv2.waitKey(1) & 0xFF == ord('q') or count >= 30:
+            focus_window('Face Registration - Stay Still')
+
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            aborted = True
             break
+        if capture_start is not None:
+            elapsed = current_time - capture_start
+            if (pool.is_full() and elapsed >= MIN_CAPTURE_SECONDS) or elapsed >= MAX_CAPTURE_SECONDS:
+                break
             
-    video_capture.release()
-    
+    if owns_camera:
+        video_capture.release()
+    if capture_start is not None and not aborted and not len(pool):
+        print(f"No usable samples for {worker_name}: every face was too blurry. Check the light and try again.")
+    if aborted or not len(pool):
+        # Nothing is written, so an earlier registration's images stay as they were
+        cv2.destroyAllWindows()
+        return 0
+
+    # Save the captured images into the datasets folder (keep gray for training) while the success
+    # screen is up
+    samples = pool.best()
+    writer = save_samples(worker_path, samples) if store is None else None
+    count = len(samples)
+
     # Show success for 3 seconds before closing
-    if count >= 30:
+    if count:
         success_frame = np.zeros((480, 640, 3), dtype=np.uint8)
         cv2.putText(success_frame, "REGISTRATION COMPLETE", (50, 240), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 255, 0), 3)
         cv2.putText(success_frame, f"Worker: {worker_name} ({user_type})", (50, 290), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
@@ -140,254 +189,912 @@ def register_face(worker_id, worker_name, user_type="worker"):
         cv2.waitKey(3000)
 
     cv2.destroyAllWindows()
-    print(f"\nCaptured {count} images. Training model...")
-    train_model()
+    if store is None:
+        count -= writer.close()
+    else:
+        store.put(worker_id, samples, meta)
+    print(f"\nCaptured {count} images. Updating model...")
+    enroll_worker(worker_id)
+    return count
+
+def load_id_map():
+    """Loads id_map.json as {str(label): {uuid, type, name}}. Upgrades the old {label: uuid} format."""
+    if not os.path.exists(MAP_FILE):
+        return {}
+    with open(MAP_FILE, "r") as f:
+        id_map = json.load(f)
+    for label, user_data in id_map.items():
+        if not isinstance(user_data, dict):
+            id_map[label] = {"uuid": user_data, "type": "worker", "name": "Unknown"}
+    return id_map
+
+def save_id_map(id_map):
+    """Writes id_map.json atomically so a crash never leaves a half-written map."""
+    tmp_path = MAP_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(id_map, f)
+    os.replace(tmp_path, MAP_FILE)
+
+def assign_label(id_map, worker_uuid, user_type="worker", user_name="Unknown"):
+    """Returns the integer label for a worker, reusing the existing one if already mapped.
+    New workers get max(label) + 1 so labels never shift when others enroll."""
+    for label, user_data in id_map.items():
+        if user_data.get("uuid") == worker_uuid:
+            user_data.update({"type": user_type, "name": user_name})
+            return int(label)
+    label = max([int(l) for l in id_map] or [0]) + 1
+    id_map[str(label)] = {"uuid": worker_uuid, "type": user_type, "name": user_name}
+    return label
+
+def read_worker_meta(worker_path):
+    """Returns (type, name) from a worker folder's meta.json."""
+    user_type = "worker"
+    user_name = "Unknown"
+    meta_path = os.path.join(worker_path, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+            user_type = meta.get("type", "worker")
+            user_name = meta.get("name", "Unknown")
+    return user_type, user_name
+
+def read_worker_samples(worker_path):
+    """Loads all grayscale face crops saved for one worker."""
+    samples = []
+    for image_name in os.listdir(worker_path):
+        if not image_name.endswith(".jpg"): continue
+        img = cv2.imread(os.path.join(worker_path, image_name), cv2.IMREAD_GRAYSCALE)
+        if img is None: continue
+        samples.append(img)
+    return samples
+
+def sample_store():
+    """The packed sample store of FACE_DATA_DIR (face_store.py), or None while samples are JPEG folders."""
+    return SampleStore(FACE_DATA_DIR) if SampleStore.exists(FACE_DATA_DIR) else None
+
+def lbph_params():
+    return {"radius": recognizer.getRadius(), "neighbors": recognizer.getNeighbors(),
+            "grid_x": recognizer.getGridX(), "grid_y": recognizer.getGridY()}
+
+def uses_model_file():
+    """True when verify reads model.bin instead of trainer.yml."""
+    return MATCHER != "lbph" and os.path.exists(MODEL_FILE)
 
+def model_exists():
+    if MATCHER == "lbph":
+        return os.path.exists(TRAINER_FILE)
+    return os.path.exists(MODEL_FILE) or os.path.exists(TRAINER_FILE)
+
+@timed_stage("enroll")
+def enroll_worker(worker_uuid):
+    """Adds one worker's samples to the existing model instead of retraining everyone: appends a segment
+    to model.bin and/or runs LBPH update() on trainer.yml, whichever verify is using (an install with only
+    trainer.yml gets its model.bin here, except under FACE_MATCHER=lbph).
+    Falls back to a full rebuild when the worker was already enrolled (LBPH can't drop old samples)."""
+    id_map = load_id_map()
+    already_enrolled = any(d.get("uuid") == worker_uuid for d in id_map.values())
+    if already_enrolled or not model_exists():
+        print("Re-enrollment or no existing model - running full rebuild.")
+        return train_model()
+
+    store = sample_store()
+    worker_path = os.path.join(FACE_DATA_DIR, str(worker_uuid))
+    if store is not None:
+        features = update_store_features(store, lbph_params())
+        if not store.count(str(worker_uuid)):
+            print("No face data found for this worker.")
+            return
+        meta = store.meta(str(worker_uuid))
+        user_type, user_name = meta.get("type", "worker"), meta.get("name", "Unknown")
+        histograms = np.concatenate([features[first:first + count] for first, count in store.segments(str(worker_uuid))])
+    else:
+        if not update_worker_features(worker_path, lbph_params()):
+            print("No face data found for this worker.")
+            return
+        user_type, user_name = read_worker_meta(worker_path)
+        histograms = load_worker_features(worker_path)
+    label = assign_label(id_map, str(worker_uuid), user_type, user_name)
+
+    labels = np.array([label] * len(histograms))
+    if MATCHER != "lbph" and not os.path.exists(MODEL_FILE):
+        # Only trainer.yml so far: convert it once, then append, instead of rewriting the YAML every time
+        import_trainer_model()
+    if os.path.exists(MODEL_FILE):
+        append_gallery(MODEL_FILE, histograms, labels, {str(label): id_map[str(label)]})
+        print(f"Enrolled {user_name} as label {label} ({len(labels)} samples). Model saved as " + MODEL_FILE)
+    if not uses_model_file():
+        if recognizer.empty():
+            recognizer.read(TRAINER_FILE)
+        samples = list(store.samples(str(worker_uuid))) if store is not None else read_worker_samples(worker_path)
+        recognizer.update(samples, labels)
+        recognizer.save(TRAINER_FILE)
+        print(f"Enrolled {user_name} as label {label} ({len(labels)} samples). Model saved as " + TRAINER_FILE)
+    save_id_map(id_map)
+
+@timed_stage("train")
 def train_model():
-    """Trains the LBPH recognizer and updates ID map with types."""
-    faces = []
+    """Full rebuild of the model from every worker folder (or the packed sample store). Existing labels are kept.
+    Histograms come from each folder's feature cache (face_features.py): only new or changed images
+    are decoded, spread over a process pool, and the model is written from the caches one person at a
+    time, so neither memory nor open files grow with the number of people."""
+    people = []
     ids = []
-    
-    id_map = {} # {int_id: {uuid: "...", type: "..."}}
-    int_counter = 0
 
-    worker_folders = [f for f in os.listdir(FACE_DATA_DIR) if os.path.isdir(os.path.join(FACE_DATA_DIR, f))]
-    
-    for worker_uuid in worker_folders:
-        int_counter += 1
-        worker_path = os.path.join(FACE_DATA_DIR, worker_uuid)
-        
-        # Read metadata if exists
-        user_type = "worker"
-        user_name = "Unknown"
-        meta_path = os.path.join(worker_path, "meta.json")
-        if os.path.exists(meta_path):
-            with open(meta_path, "r") as f:
-                meta = json.load(f)
-                user_type = meta.get("type", "worker")
-                user_name = meta.get("name", "Unknown")
-        
-        id_map[str(int_counter)] = {"uuid": worker_uuid, "type": user_type, "name": user_name}
-        
-        for image_name in os.listdir(worker_path):
-            if not image_name.endswith(".jpg"): continue
-            img_path = os.path.join(worker_path, image_name)
-            img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
-            if img is None: continue
-            faces.append(img)
-            ids.append(int_counter)
-
-    if faces:
-        recognizer.train(faces, np.array(ids))
-        recognizer.save(TRAINER_FILE)
-        with open(MAP_FILE, "w") as f:
-            json.dump(id_map, f)
-        print("Training complete! Model saved as " + TRAINER_FILE)
+    old_map = load_id_map()
+    id_map = {} # {int_id: {uuid: "...", type: "...", name: "..."}}
+
+    store = sample_store()
+    if store is not None:
+        workers = store.user_ids()
+    else:
+        workers = sorted(f for f in os.listdir(FACE_DATA_DIR) if os.path.isdir(os.path.join(FACE_DATA_DIR, f)))
+
+    # Keep labels of workers that are still on disk, then number new folders after them
+    for label, user_data in old_map.items():
+        if user_data.get("uuid") in workers:
+            id_map[label] = user_data
+
+    params = lbph_params()
+    for worker_uuid, (user_type, user_name), count, load in training_samples(store, workers, params):
+        label = assign_label(id_map, worker_uuid, user_type, user_name)
+        people.append(load)
+        ids.extend([label] * count)
+
+    def histograms():
+        # One person's rows at a time; each mapping is dropped before the next is opened
+        for load in people:
+            yield load()
+
+    # Drop labels whose folders had no usable images
+    used_labels = set(ids)
+    id_map = {l: d for l, d in id_map.items() if int(l) in used_labels}
+
+    if ids:
+        write_gallery_chunks(MODEL_FILE, histograms(), ids, id_map, params)
+        # The YAML model is only needed when verify runs on OpenCV's own predict()
+        if MATCHER == "lbph":
+            write_lbph_model(TRAINER_FILE, (row for rows in histograms() for row in rows), ids, params)
+            recognizer.read(TRAINER_FILE)
+        save_id_map(id_map)
+        print("Training complete! Model saved as " + MODEL_FILE)
     else:
         print("No face data found to train.")
 
-def verify_and_mark_attendance():
-    """Starts camera, recognizes face, matches with ID, and pings Supabase."""
-    if not os.path.exists(TRAINER_FILE):
-        print("Model not trained. Register workers first.")
+def training_samples(store, workers, params):
+    """Yields (uuid, (type, name), count, load) for everyone with samples, from the sample store or
+    from the worker folders' feature caches. load() returns the person's histograms as read-only
+    memory-mapped rows; call it only when they are needed and drop them before the next person's."""
+    if store is not None:
+        # Rows left behind by re-registrations are dropped once they make up half the file
+        if store.garbage() * 2 > store.records:
+            store.compact()
+        features = update_store_features(store, params)
+        for worker_uuid in workers:
+            meta = store.meta(worker_uuid)
+            segments = store.segments(worker_uuid)
+            if segments:
+                yield worker_uuid, (meta.get("type", "worker"), meta.get("name", "Unknown")), \
+                    sum(count for _, count in segments), \
+                    lambda segments=segments: np.concatenate([features[first:first + count]
+                                                              for first, count in segments])
+        return
+    worker_paths = [os.path.join(FACE_DATA_DIR, f) for f in workers]
+    for worker_path, count in update_features(worker_paths, params):
+        if count:
+            yield os.path.basename(worker_path), read_worker_meta(worker_path), count, \
+                lambda worker_path=worker_path: load_worker_features(worker_path)
+
+@timed_stage("model_load")
+def load_model():
+    """Loads the model FACE_MATCHER asks for. Returns (id_map, recognize).
+    model.bin is memory-mapped in milliseconds; trainer.yml has to be parsed into the recognizer."""
+    if uses_model_file():
+        gallery = load_gallery(MODEL_FILE, prototypes=MATCHER == "prototype")
+        return gallery.id_map, gallery
+    if os.path.exists(MODEL_FILE) and os.path.getmtime(MODEL_FILE) > os.path.getmtime(TRAINER_FILE):
+        print("Warning: trainer.yml is older than model.bin. Run 'python face_lock.py train' to refresh it.")
+    recognizer.read(TRAINER_FILE)
+    return load_id_map(), make_matcher()
+
+def import_trainer_model():
+    """Converts an existing trainer.yml + id_map.json into model.bin."""
+    recognizer.read(TRAINER_FILE)
+    write_gallery(MODEL_FILE, recognizer.getHistograms(), recognizer.getLabels(), load_id_map(), lbph_params())
+    print(f"Imported {TRAINER_FILE} into {MODEL_FILE}")
+
+# LBPH confidence is a distance (lower is better); usually < 70 is a good match
+MATCH_THRESHOLD = 75
+
+def recognize_faces(gray, faces):
+    """Runs the LBPH recognizer on each detected face. Returns [((x, y, w, h), label, distance)]."""
+    return [((x, y, w, h),) + tuple(recognizer.predict(gray[y:y+h, x:x+w])) for (x, y, w, h) in faces]
+
+def make_matcher():
+    """Returns the recognize(gray, faces) function selected by FACE_MATCHER for the loaded model."""
+    if MATCHER in ("gallery", "prototype"):
+        return GalleryMatcher.from_recognizer(recognizer, prototypes=MATCHER == "prototype")
+    return recognize_faces
+
+def lookup_user(id_map, id_int):
+    """Returns (uuid, type, name) for a label, or None if the label isn't mapped."""
+    user_data = id_map.get(str(id_int))
+    if not user_data:
+        return None
+    if isinstance(user_data, dict):
+        return user_data.get("uuid"), user_data.get("type", "worker"), user_data.get("name", "Unknown")
+    # Fallback for old map format
+    return user_data, "worker", "Unknown"
+
+def match_user(id_map, id_int, confidence):
+    """Returns lookup_user() for a recognition close enough to count as a match, else None,
+    and counts it in the recognitions metric."""
+    user = lookup_user(id_map, id_int) if confidence < MATCH_THRESHOLD else None
+    RECOGNITIONS.inc("match" if user else "no_match")
+    return user
+
+def model_missing(alert=False):
+    """True (after telling the operator) when no model has been trained yet.
+    alert=True also pops up a message box on Windows."""
+    if model_exists():
+        return False
+    print("Model not trained. Register workers first.")
+    if alert:
         try:
             import ctypes
             ctypes.windll.user32.MessageBoxW(0, "No registered faces found!\n\nPlease go to 'Register Support Staff' -> Create/Select Worker -> 'Register Face' first.", "Scanner Error", 0x10)
         except:
             pass
+    return True
+
+def verify_and_mark_attendance(video_capture=None, id_map=None, headless=False, recognize=None):
+    """Starts camera, recognizes face, matches with ID, and pings Supabase.
+    Returns {uuid, name, type, message, status} for the matched person, or None if nobody was verified.
+    A warm caller passes its open video_capture, the already loaded id_map and its matcher to skip startup work.
+    video_capture can be any frame source from face_pipeline (webcam, video file, image folder);
+    headless=True runs without opening a window."""
+    if id_map is None and model_missing(alert=True):
         return
 
-    recognizer.read(TRAINER_FILE)
-    with open(MAP_FILE, "r") as f:
-        id_map = json.load(f)
+    if id_map is None or recognize is None:
+        id_map, recognize = load_model()
+    # Today's attendance loads in the background while the camera opens
+    today_attendance().seed()
 
-    # We need names too? LBPH doesn't store names. 
-    # For now, we'll just show the ID or "Verified"
-    
-    video_capture = cv2.VideoCapture(0)
+    owns_camera = video_capture is None
+    if owns_camera:
+        with STAGE_SECONDS.time("camera_open"):
+            video_capture = open_frame_source(CAMERA_INDEX)
     print("Attendance Scanner Active. Press 'q' to quit.")
 
     window_name = 'Attendance Scanner'
-    cv2.namedWindow(window_name, cv2.WINDOW_AUTOSIZE)
-    cv2.setWindowProperty(window_name, cv2.WND_PROP_TOPMOST, 1)
+    if not headless:
+        cv2.namedWindow(window_name, cv2.WINDOW_AUTOSIZE)
+        cv2.setWindowProperty(window_name, cv2.WND_PROP_TOPMOST, 1)
 
-    while True:
-        ret, frame = video_capture.read()
-        if not ret: break
+    # Capture, detection and recognition run on their own threads; this loop only draws and decides
+    pipeline = FramePipeline(video_capture, FaceDetector(face_cascade, 1.2, 5), recognize).start()
+    focus_retry = 0
+    match = None
+    try:
+        while match is None:
+            result = pipeline.next_result(timeout=None if headless else 0)
+            if result is END_OF_STREAM:
+                break
 
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, 1.2, 5)
+            if result is not None:
+                for (x, y, w, h), id_int, confidence in result.matches:
+                    user = match_user(id_map, id_int, confidence)
+                    if user:
+                        user_uuid, user_type, user_name = user
+                        print(f"Verified: {user_name} ({user_type}) Conf:{round(100 - confidence)}%")
 
-        for (x, y, w, h) in faces:
-            id_int, confidence = recognizer.predict(gray[y:y+h, x:x+w])
-            
-            # Confidence for LBPH is distance (Lower is better)
-            # Usually < 70 is a good match
-            if confidence < 75:
-                user_data = id_map.get(str(id_int))
-                if user_data:
-                    if isinstance(user_data, dict):
-                        user_uuid = user_data.get("uuid")
-                        user_type = user_data.get("type", "worker")
-                        user_name = user_data.get("name", "Unknown")
-                    else:
-                        # Fallback for old map format
-                        user_uuid = user_data
-                        user_type = "worker"
-                        user_name = "Unknown"
-
-                    print(f"Verified: {user_name} ({user_type}) Conf:{round(100 - confidence)}%")
-                    
-                    # Mark attendance in Supabase and get status string
-                    status_msg = mark_supabase_attendance(user_uuid, user_type, user_name)
-                    
-                    # Visual Feedback
+                        # Journal the scan locally (synced to Supabase in the background) and get status string
+                        status_msg = record_attendance(user_uuid, user_type, user_name)
+                        match = {"uuid": user_uuid, "name": user_name, "type": user_type,
+                                 "message": status_msg, "status": attendance_status(status_msg)}
+
+                        if not headless:
+                            # Visual Feedback on the frame the face was found in
+                            frame = result.frame
+                            cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+                            cv2.putText(frame, f"{user_name}", (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+                            if status_msg:
+                                cv2.putText(frame, status_msg, (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
+                            cv2.imshow(window_name, frame)
+                            cv2.waitKey(4000) # Show for 4 seconds so they can read it
+                        break
+
+            if headless:
+                continue
+
+            frame = pipeline.latest_frame()
+            if frame is None:
+                if cv2.waitKey(10) & 0xFF == ord('q'):
+                    break
+                continue
+            frame = frame.copy()
+            last = pipeline.last_result
+            if last is not None:
+                for (x, y, w, h), id_int, confidence in last.matches:
+                    if confidence >= MATCH_THRESHOLD:
+                        cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 0, 255), 2)
+                        cv2.putText(frame, "Unknown", (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+
+            cv2.imshow(window_name, frame)
+
+            # Aggressive "Bring to Front" loop for first few frames
+            if focus_retry < 10:
+                focus_window(window_name)
+                focus_retry += 1
+
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    finally:
+        pipeline.stop()
+        if owns_camera:
+            video_capture.release()
+        if not headless:
+            cv2.destroyAllWindows()
+    return match
+
+def scan_gates(sources, workers=None):
+    """Continuous attendance scanning of several cameras (webcam indexes, video files or image folders)
+    from one process over one shared model. Runs until the sources end or Ctrl+C.
+    Returns the per-gate frame counts."""
+    if model_missing():
+        return None
+    id_map, recognize = load_model()
+    dispatcher = AttendanceDispatcher(on_marked=lambda m: print(f"[{m['source']}] {m['message']}"))
+
+    def on_frame(stream, result):
+        for _, id_int, confidence in result.matches:
+            user = match_user(id_map, id_int, confidence)
+            if user:
+                dispatcher.submit(user, source=stream.name)
+
+    sources = {str(source): open_frame_source(source) for source in sources}
+    scanner = MultiGateScanner(sources, recognize, on_frame, workers).start()
+    print(f"Scanning {len(sources)} gate(s) with {scanner.workers} worker(s). Press Ctrl+C to stop.")
+    try:
+        while not scanner.wait(timeout=1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scanner.stop()
+        for source in sources.values():
+            source.release()
+        dispatcher.close()
+    return scanner.stats()
+
+def recognize_batch(frames, id_map=None, recognize=None, workers=None, track=False, tag="image", min_face=None):
+    """Recognizes a finite batch of frames on a worker pool, without a window or attendance marking.
+    frames comes from face_batch (video_frames, image_frames, folder_frames); tag names the field the
+    frame's time or file name goes into; min_face (pixels) skips smaller faces for speed.
+    Yields one dict per frame, in order:
+    {"frame", tag, "faces": [{"box", "uuid", "name", "type", "distance"}]}; unknown faces have uuid None."""
+    if id_map is None or recognize is None:
+        id_map, recognize = load_model()
+    for index, label, result in BatchRecognizer(recognize, workers, track=track, min_face=min_face).run(frames):
+        if result is None:
+            yield {"frame": index, tag: label, "faces": [], "error": "unreadable image"}
+            continue
+        faces = []
+        for (x, y, w, h), id_int, confidence in result.matches:
+            user = match_user(id_map, id_int, confidence)
+            user_uuid, user_type, user_name = user or (None, None, "Unknown")
+            faces.append({"box": [int(x), int(y), int(w), int(h)], "uuid": user_uuid, "name": user_name,
+                          "type": user_type, "distance": round(float(confidence), 2)})
+        yield {"frame": index, tag: label, "faces": faces}
+
+def recognize_file(path, step=1, id_map=None, recognize=None, workers=None, min_face=None):
+    """recognize_batch() over a video file (every step-th frame, tagged with its time in seconds)
+    or a folder of images (tagged with the file name)."""
+    if os.path.isdir(path):
+        return recognize_batch(folder_frames(path), id_map, recognize, workers, min_face=min_face)
+    return recognize_batch(video_frames(path, step), id_map, recognize, workers, track=step == 1, tag="time",
+                           min_face=min_face)
+
+class AttendanceDispatcher:
+    """Marks attendance on a background thread so the scanning loop never waits for it.
+    Each person is dispatched once per cooldown however many frames they appear in; the outcome is
+    kept for OVERLAY_SECONDS so the screen can show it next to their face."""
+
+    def __init__(self, cooldown=None, on_marked=None):
+        self.cooldown = SCAN_COOLDOWN if cooldown is None else cooldown
+        self.on_marked = on_marked
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.dispatched = {}  # uuid -> time of the last dispatch
+        self.latest = {}      # uuid -> (time marked, result)
+        self.marked = []      # every result, in order
+        self.thread = threading.Thread(target=self._run, name="attendance-dispatch", daemon=True)
+        self.thread.start()
+
+    def submit(self, user, source=None):
+        """Queues (uuid, type, name) for marking. Returns False while the person is in their cooldown."""
+        now = time.time()
+        with self.lock:
+            if now - self.dispatched.get(user[0], 0) < self.cooldown:
+                return False
+            self.dispatched[user[0]] = now
+        self.queue.put((user, source))
+        return True
+
+    def status(self, user_uuid):
+        """The person's on-screen message while it is fresh, else None."""
+        with self.lock:
+            entry = self.latest.get(user_uuid)
+        if entry and time.time() - entry[0] < OVERLAY_SECONDS:
+            return entry[1]["message"]
+        return None
+
+    def recent(self):
+        """Results marked within the last OVERLAY_SECONDS, newest first."""
+        now = time.time()
+        with self.lock:
+            entries = sorted(self.latest.values(), key=lambda e: e[0], reverse=True)
+        return [result for marked_at, result in entries if now - marked_at < OVERLAY_SECONDS]
+
+    def close(self, timeout=10):
+        """Waits for queued people to be marked."""
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def _run(self):
+        # Today's attendance loads in the background while the camera warms up
+        today_attendance().seed()
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            (user_uuid, user_type, user_name), source = item
+            try:
+                status_msg = record_attendance(user_uuid, user_type, user_name)
+            except Exception as e:
+                print(f"Marking attendance for {user_name} failed: {e}")
+                continue
+            result = {"uuid": user_uuid, "name": user_name, "type": user_type, "source": source,
+                      "message": status_msg, "status": attendance_status(status_msg)}
+            with self.lock:
+                self.latest[user_uuid] = (time.time(), result)
+                self.marked.append(result)
+            if self.on_marked:
+                self.on_marked(result)
+
+def scan_continuously(video_capture=None, id_map=None, recognize=None, headless=False, stop=None):
+    """Kiosk mode: keeps scanning until 'q' (or the end of a video/folder, or until the threading.Event
+    stop is set) and marks everyone in view, several people per frame, without pausing. Attendance is
+    marked on a background thread and each person's status is drawn next to their face for a few
+    seconds. Returns the list of people marked."""
+    if id_map is None and model_missing():
+        return []
+    if id_map is None or recognize is None:
+        id_map, recognize = load_model()
+
+    owns_camera = video_capture is None
+    if owns_camera:
+        with STAGE_SECONDS.time("camera_open"):
+            video_capture = open_frame_source(CAMERA_INDEX)
+    print("Continuous Attendance Scanner Active. Press 'q' to quit.")
+
+    window_name = 'Attendance Scanner'
+    if not headless:
+        cv2.namedWindow(window_name, cv2.WINDOW_AUTOSIZE)
+        cv2.setWindowProperty(window_name, cv2.WND_PROP_TOPMOST, 1)
+
+    dispatcher = AttendanceDispatcher(on_marked=lambda m: print(f"{m['name']}: {m['message']}"))
+    pipeline = FramePipeline(video_capture, FaceDetector(face_cascade, 1.2, 5), recognize).start()
+    focus_retry = 0
+    try:
+        while stop is None or not stop.is_set():
+            # Headless waits for results, but wakes up now and then to notice stop
+            result = pipeline.next_result(timeout=(None if stop is None else 0.5) if headless else 0)
+            if result is END_OF_STREAM:
+                break
+            if result is not None:
+                for _, id_int, confidence in result.matches:
+                    user = match_user(id_map, id_int, confidence)
+                    if user:
+                        dispatcher.submit(user)
+
+            if headless:
+                continue
+
+            frame = pipeline.latest_frame()
+            if frame is None:
+                if cv2.waitKey(10) & 0xFF == ord('q'):
+                    break
+                continue
+            frame = frame.copy()
+            last = pipeline.last_result
+            for (x, y, w, h), id_int, confidence in (last.matches if last is not None else []):
+                user = lookup_user(id_map, id_int) if confidence < MATCH_THRESHOLD else None
+                if user:
                     cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
-                    cv2.putText(frame, f"{user_name}", (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+                    cv2.putText(frame, user[2], (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+                    status_msg = dispatcher.status(user[0])
                     if status_msg:
-                        cv2.putText(frame, status_msg, (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
-                    
-                    cv2.imshow(window_name, frame)
-                    cv2.waitKey(4000) # Show for 4 seconds so they can read it
-                    video_capture.release()
-                    cv2.destroyAllWindows()
-                    return
-            else:
-                cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 0, 255), 2)
-                cv2.putText(frame, "Unknown", (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+                        cv2.putText(frame, status_msg, (x, y+h+25), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+                else:
+                    cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 0, 255), 2)
+                    cv2.putText(frame, "Unknown", (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+            # Everyone marked in the last few seconds, newest on top
+            for row, marked in enumerate(dispatcher.recent()[:5]):
+                cv2.putText(frame, marked["message"], (20, 40 + 32 * row), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 255), 2)
 
-        cv2.imshow(window_name, frame)
-        
-        # Aggressive "Bring to Front" loop for first few frames
-        if 'focus_retry' not in locals(): focus_retry = 0
-        if focus_retry < 10:
-            try:
-                import ctypes
-                hwnd = ctypes.windll.user32.FindWindowW(None, 'Attendance Scanner')
-                if hwnd:
-                    ctypes.windll.user32.SetWindowPos(hwnd, -1, 0, 0, 0, 0, 0x0001 | 0x0002 | 0x0040)
-                    ctypes.windll.user32.SetForegroundWindow(hwnd)
-                    ctypes.windll.user32.ShowWindow(hwnd, 5)
+            cv2.imshow(window_name, frame)
+            if focus_retry < 10:
+                focus_window(window_name)
                 focus_retry += 1
-            except:
-                pass
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    finally:
+        pipeline.stop()
+        if owns_camera:
+            video_capture.release()
+        dispatcher.close()
+        if not headless:
+            cv2.destroyAllWindows()
+    return dispatcher.marked
 
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+def focus_window(title):
+    """Brings an OpenCV window to the front on Windows (no-op elsewhere)."""
+    try:
+        import ctypes
+        hwnd = ctypes.windll.user32.FindWindowW(None, title)
+        if hwnd:
+            ctypes.windll.user32.SetWindowPos(hwnd, -1, 0, 0, 0, 0, 0x0001 | 0x0002 | 0x0040)
+            ctypes.windll.user32.SetForegroundWindow(hwnd)
+            ctypes.windll.user32.SetActiveWindow(hwnd)
+            ctypes.windll.user32.ShowWindow(hwnd, 5)
+    except:
+        pass
 
-    video_capture.release()
-    cv2.destroyAllWindows()
+def attendance_status(status_msg):
+    """Maps the on-screen message from mark_supabase_attendance() to a short machine-readable status."""
+    if status_msg.startswith("WELCOME"):
+        return "checked_in"
+    if status_msg.startswith("GOODBYE"):
+        return "checked_out"
+    if status_msg.startswith("Already Done"):
+        return "already_done"
+    return "error"
 
-def mark_supabase_attendance(user_id, user_type, user_name="User"):
-    """Post attendance record to Supabase. Handles Check-In and Check-Out. Returns status string."""
-    url = f"{SUPABASE_URL}/rest/v1/attendance"
-    headers = {
+# Candidate attendance columns; older schemas used different names for the timestamps
+ATTENDANCE_OPTIONAL_COLUMNS = ["user_type", "status", "check_in", "in_time", "check_in_time", "check_out", "out_time"]
+CHECK_IN_COLUMNS = ["check_in", "in_time", "check_in_time"]
+CHECK_OUT_COLUMNS = ["check_out", "out_time"]
+
+_http_session = None
+# Per Supabase URL (the bridge can pass a different project per request)
+_attendance_columns = {}  # url -> optional columns that exist, probed once per process
+_attendance_rpc = {}      # url -> whether mark_attendance() is installed, learned on first call
+_attendance_batch_rpc = {}  # url -> whether mark_attendance_batch() is installed
+_journal = None
+_today = None
+
+class TimeoutSession(requests.Session):
+    """requests.Session with HTTP_TIMEOUT as the default timeout (requests has none)."""
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault("timeout", HTTP_TIMEOUT)
+        return super().request(*args, **kwargs)
+
+def http_session():
+    """One keep-alive session for all Supabase calls, so scans reuse the TLS connection."""
+    global _http_session
+    if _http_session is None:
+        _http_session = TimeoutSession()
+        if METRICS_ENABLED:
+            _http_session.hooks["response"].append(record_request_metrics)
+    return _http_session
+
+def record_request_metrics(response, *args, **kwargs):
+    """requests response hook: counts Supabase calls per endpoint/status and their latency."""
+    endpoint = urllib.parse.urlparse(response.url).path.replace("/rest/v1/", "", 1)
+    method = response.request.method
+    HTTP_REQUESTS.inc(method, endpoint, str(response.status_code))
+    HTTP_SECONDS.observe(response.elapsed.total_seconds(), method, endpoint)
+
+def supabase_headers():
+    return {
         "apikey": SUPABASE_KEY,
         "Authorization": f"Bearer {SUPABASE_KEY}",
         "Content-Type": "application/json",
         "Prefer": "return=representation"
     }
-    
-    today = datetime.now().date().isoformat()
-    current_time = datetime.now()
-    time_str = current_time.strftime("%I:%M %p")
-    iso_time = current_time.isoformat()
 
-    # 1. Check if already checked in today
-    query_url = f"{url}?user_id=eq.{user_id}&date=eq.{today}&select=*"
-    try:
-        get_res = requests.get(query_url, headers=headers)
-        records = get_res.json()
-        
-        if records and len(records) > 0:
-            # ALREADY CHECKED IN -> DO CHECK OUT
-            record_id = records[0]['id']
-            if records[0]['check_out']:
-                print("Already checked out for today!")
-                return f"Already Done: {time_str}"
-            
-            print(f"Checking OUT for ID: {record_id}")
-            update_url = f"{url}?id=eq.{record_id}"
-            
-            # Helper to try PATCH
-            def try_patch(payload):
-                res = requests.patch(update_url, headers=headers, json=payload)
-                if res.status_code in [200, 204]:
-                    return True, res
-                return False, res
-
-            # Attempt 1: All columns
-            success, res = try_patch({"check_out": iso_time, "out_time": iso_time})
-            if not success:
-                 print("Retry 1: check_out only")
-                 success, res = try_patch({"check_out": iso_time})
-            if not success:
-                 print("Retry 2: out_time only")
-                 success, res = try_patch({"out_time": iso_time})
-
-            if success:
-                print(f"Check-out recorded successfully! Time: {iso_time}")
-                return f"GOODBYE {user_name}! OUT: {time_str}"
-            else:
-                print(f"Check-out FAILED. Last Error: {res.text}")
-                return "Error: Update Failed"
+def attendance_columns():
+    """Returns the set of optional attendance columns that exist. Probed once, then cached."""
+    if SUPABASE_URL not in _attendance_columns:
+        url = f"{SUPABASE_URL}/rest/v1/attendance"
+        session = http_session()
+        # limit=0 returns no rows; PostgREST answers 400 if any selected column is missing
+        res = session.get(f"{url}?select={','.join(ATTENDANCE_OPTIONAL_COLUMNS)}&limit=0", headers=supabase_headers())
+        if res.status_code == 200:
+            found = set(ATTENDANCE_OPTIONAL_COLUMNS)
+        else:
+            found = set()
+            for column in ATTENDANCE_OPTIONAL_COLUMNS:
+                res = session.get(f"{url}?select={column}&limit=0", headers=supabase_headers())
+                if res.status_code == 200:
+                    found.add(column)
+                elif res.status_code != 400:
+                    res.raise_for_status()
+        print(f"Attendance columns: {', '.join(sorted(found))}")
+        _attendance_columns[SUPABASE_URL] = found
+    return _attendance_columns[SUPABASE_URL]
+
+# Rows per request when exporting attendance (Supabase returns at most 1000 per request by default)
+EXPORT_PAGE_SIZE = 1000
+
+def fetch_attendance_rows(start, end, page_size=EXPORT_PAGE_SIZE):
+    """Yields attendance rows dated start..end (date objects) as {id, user_id, user_type, date, check_in,
+    check_out}, day by day. Each day is read with keyset pagination in id order (id=gt.<last id seen>),
+    so every page is one index range scan however many rows came before it, and only one page is
+    held in memory at a time."""
+    url = f"{SUPABASE_URL}/rest/v1/attendance"
+    session = http_session()
+    columns = attendance_columns()
+    in_columns = [c for c in CHECK_IN_COLUMNS if c in columns]
+    out_columns = [c for c in CHECK_OUT_COLUMNS if c in columns]
+    select = ",".join(["id", "user_id", "date"] + (["user_type"] if "user_type" in columns else [])
+                      + in_columns + out_columns)
+    day = start
+    while day <= end:
+        last_id = None
+        while True:
+            params = {"select": select, "date": f"eq.{day.isoformat()}", "order": "id.asc", "limit": page_size}
+            if last_id is not None:
+                params["id"] = f"gt.{last_id}"
+            res = session.get(url, params=params, headers=supabase_headers())
+            res.raise_for_status()
+            page = res.json()
+            for row in page:
+                yield {"id": row["id"], "user_id": row.get("user_id"), "user_type": row.get("user_type"),
+                       "date": row.get("date"),
+                       "check_in": next((row[c] for c in in_columns if row.get(c)), None),
+                       "check_out": next((row[c] for c in out_columns if row.get(c)), None)}
+            if len(page) < page_size:
+                break
+            last_id = page[-1]["id"]
+        day += timedelta(days=1)
+
+def export_attendance(start, end, output=None, detail=False, by="user", page_size=EXPORT_PAGE_SIZE):
+    """Writes worked hours for start..end to output (.csv or .json; stdout as CSV when None), streaming
+    the attendance table page by page (see attendance_export.py). Names come from id_map.json.
+    Returns the HoursSummary."""
+    import contextlib
+    import sys
+    people = {d.get("uuid"): d for d in load_id_map().values()}
+    fmt = "json" if output and output.lower().endswith(".json") else "csv"
+    rows = fetch_attendance_rows(start, end, page_size)
+    period = {"from": start.isoformat(), "to": end.isoformat()}
+    if output is None:
+        out = sys.stdout
+        # Progress prints (e.g. the attendance columns found) go to stderr; stdout carries only the CSV
+        with contextlib.redirect_stdout(sys.stderr):
+            return export_hours(rows, out, fmt, detail, by, people, period)
+    with open(output, "w", newline="") as f:
+        summary = export_hours(rows, f, fmt, detail, by, people, period)
+    print(f"Exported {len(summary.totals)} people to {output}")
+    return summary
 
+def attendance_journal():
+    """The process-wide scan journal; its flusher thread starts on first use."""
+    global _journal
+    if _journal is None:
+        _journal = AttendanceJournal(JOURNAL_FILE, push_attendance_batch).start()
+    return _journal
+
+def today_attendance():
+    """The process-wide table of today's check-in/check-out state (see attendance_state.py)."""
+    global _today
+    if _today is None:
+        _today = TodayAttendance(load_attendance_day, load_journal_day, cooldown=SCAN_COOLDOWN)
+    return _today
+
+def load_journal_day(date):
+    """({user_id: stage}, {user_id: time of last scan}) for a day from the journal alone; no network."""
+    scans = attendance_journal().last_scans(date)
+    return ({user_id: min(count, CHECKED_OUT) for user_id, (count, _) in scans.items()},
+            {user_id: scanned_at for user_id, (_, scanned_at) in scans.items()})
+
+def load_attendance_day(date):
+    """{user_id: stage} for a day: Supabase's rows plus scans still waiting in the journal.
+    Raises while Supabase is unreachable."""
+    stages = fetch_attendance_stages(date)
+    journal = attendance_journal()
+    # Read the journal with no batch in flight, so a scan Supabase already counted can't still look
+    # pending. One synced after the GET is missed here; TodayAttendance keeps it from the journal
+    with journal.flush_lock:
+        local_scans = journal.scans_by_user(date, pending_only=True)
+    for user_id, count in local_scans.items():
+        stages[user_id] = min(stages.get(user_id, 0) + count, CHECKED_OUT)
+    print(f"Attendance state for {date}: {len(stages)} user(s)")
+    return stages
+
+def fetch_attendance_stages(date, page_size=EXPORT_PAGE_SIZE):
+    """All of a day's attendance rows as {user_id: CHECKED_IN | CHECKED_OUT}, read page by page in id
+    order like fetch_attendance_rows (a single request would stop at Supabase's row limit)."""
+    url = f"{SUPABASE_URL}/rest/v1/attendance"
+    session = http_session()
+    out_columns = [c for c in CHECK_OUT_COLUMNS if c in attendance_columns()]
+    select = ",".join(["id", "user_id"] + out_columns)
+    stages = {}
+    last_id = None
+    while True:
+        params = {"select": select, "date": f"eq.{date}", "order": "id.asc", "limit": page_size}
+        if last_id is not None:
+            params["id"] = f"gt.{last_id}"
+        res = session.get(url, params=params, headers=supabase_headers())
+        res.raise_for_status()
+        page = res.json()
+        for row in page:
+            stage = CHECKED_OUT if any(row.get(c) for c in out_columns) else CHECKED_IN
+            stages[row["user_id"]] = max(stage, stages.get(row["user_id"], 0))
+        if len(page) < page_size:
+            return stages
+        last_id = page[-1]["id"]
+
+@timed_stage("attendance_record")
+def record_attendance(user_id, user_type, user_name="User"):
+    """Decides check-in/check-out from today's local state, journals the scan and returns the kiosk
+    status string at once. The journal syncs it to Supabase, which applies the same rules.
+    A repeat scan inside the cooldown returns the previous message and records nothing."""
+    now = datetime.now()
+    time_str = now.strftime("%I:%M %p")
+
+    def describe(action):
+        if action == "check_in":
+            return f"WELCOME {user_name}! IN: {time_str}"
+        if action == "check_out":
+            return f"GOODBYE {user_name}! OUT: {time_str}"
+        return f"Already Done: {time_str}"
+
+    action, status_msg = today_attendance().scan(user_id, describe, now)
+    if action is None:
+        print(f"{user_name} was marked less than {SCAN_COOLDOWN}s ago; not marking again")
+    elif action != "already_done":
+        attendance_journal().record(user_id, user_type, user_name, now)
+    return status_msg
+
+@timed_stage("attendance_sync")
+def push_attendance_batch(events):
+    """Sends journaled scans to Supabase in one mark_attendance_batch() call.
+    Returns {event_key: (action, error)}; raises on network errors so the journal retries."""
+    if _attendance_batch_rpc.get(SUPABASE_URL) is not False:
+        payload = [{k: event[k] for k in ("event_key", "user_id", "user_type", "date", "ts")} for event in events]
+        res = http_session().post(f"{SUPABASE_URL}/rest/v1/rpc/mark_attendance_batch", headers=supabase_headers(),
+                                  json={"p_events": payload})
+        if res.status_code == 404 or "PGRST202" in res.text:
+            print("mark_attendance_batch() not installed (see database/Attendance_Scan_RPC.sql). Syncing one by one.")
+            _attendance_batch_rpc[SUPABASE_URL] = False
         else:
-            # NOT CHECKED IN -> DO CHECK IN
-            print("Checking IN...")
-            
-            # Helper to try POST
-            def try_post(payload):
-                res = requests.post(url, headers=headers, json=payload)
-                if res.status_code == 201:
-                    return True, res
-                return False, res
-
-            base_data = {
-                "user_id": user_id,
-                "user_type": user_type,
-                "date": today,
-                "status": "present"
-            }
-
-            # Attempt 1: All columns
-            payload = base_data.copy()
-            payload.update({"check_in": iso_time, "in_time": iso_time, "check_in_time": iso_time})
-            success, res = try_post(payload)
-
-            if not success:
-                print("Retry 1: check_in only")
-                payload = base_data.copy()
-                payload.update({"check_in": iso_time})
-                success, res = try_post(payload)
-
-            if not success:
-                print("Retry 2: check_in_time only")
-                payload = base_data.copy()
-                payload.update({"check_in_time": iso_time})
-                success, res = try_post(payload)
-            
-            if not success:
-                print("Retry 3: in_time only")
-                payload = base_data.copy()
-                payload.update({"in_time": iso_time})
-                success, res = try_post(payload)
+            res.raise_for_status()
+            _attendance_batch_rpc[SUPABASE_URL] = True
+            return {r["event_key"]: (r["action"], r.get("error")) for r in res.json()}
 
-            if success:
-                print(f"Check-in recorded successfully! Time: {iso_time}")
-                return f"WELCOME {user_name}! IN: {time_str}"
-            else:
-                if "foreign key constraint" in res.text:
-                    print("Error: User ID does not exist in the database.")
-                    return "Error: User Not Found (Re-register)"
-                
-                print(f"Check-in FAILED. Last Error: {res.text}")
-                return "Error: Check-in Failed"
-                
+    # One scan at a time; stops at the first network error and leaves the rest pending.
+    # Unlike the batch RPC this is not idempotent if a request dies after the server applied it.
+    actions = {"checked_in": "check_in", "checked_out": "check_out", "already_done": "already_done"}
+    results = {}
+    for event in events:
+        try:
+            status_msg = send_attendance(event["user_id"], event["user_type"], event["user_name"],
+                                         datetime.fromisoformat(event["ts"]))
+        except Exception:
+            if not results:
+                raise
+            break
+        action = actions.get(attendance_status(status_msg))
+        results[event["event_key"]] = (action, None if action else status_msg)
+    return results
+
+def mark_supabase_attendance(user_id, user_type, user_name="User", scanned_at=None):
+    """Post attendance record to Supabase. Handles Check-In and Check-Out. Returns status string."""
+    try:
+        return send_attendance(user_id, user_type, user_name, scanned_at)
     except Exception as e:
         print(f"Failed to connect to Supabase: {e}")
         return "Error: Connection Failed"
 
+@timed_stage("attendance_write")
+def send_attendance(user_id, user_type, user_name="User", scanned_at=None):
+    """Check-in/check-out for one scan; network errors and outages (see raise_if_unavailable) propagate.
+    Uses the mark_attendance() RPC (database/Attendance_Scan_RPC.sql) for a single round trip;
+    without it, looks up today's row and does one insert/update with the columns that exist."""
+    current_time = scanned_at or datetime.now()
+    today = current_time.date().isoformat()
+    time_str = current_time.strftime("%I:%M %p")
+    iso_time = current_time.isoformat()
+
+    if _attendance_rpc.get(SUPABASE_URL) is not False:
+        res = http_session().post(f"{SUPABASE_URL}/rest/v1/rpc/mark_attendance", headers=supabase_headers(),
+                                  json={"p_user_id": user_id, "p_user_type": user_type,
+                                        "p_date": today, "p_time": iso_time})
+        if res.status_code == 404 or "PGRST202" in res.text:
+            print("mark_attendance() not installed (see database/Attendance_Scan_RPC.sql). Using table writes.")
+            _attendance_rpc[SUPABASE_URL] = False
+        else:
+            _attendance_rpc[SUPABASE_URL] = True
+            if res.status_code != 200:
+                return attendance_error(res)
+            action = res.json().get("action")
+            if action == "check_in":
+                print(f"Check-in recorded successfully! Time: {iso_time}")
+                return f"WELCOME {user_name}! IN: {time_str}"
+            if action == "check_out":
+                print(f"Check-out recorded successfully! Time: {iso_time}")
+                return f"GOODBYE {user_name}! OUT: {time_str}"
+            print("Already checked out for today!")
+            return f"Already Done: {time_str}"
+
+    return mark_attendance_by_table(user_id, user_type, user_name, today, iso_time, time_str)
+
+def mark_attendance_by_table(user_id, user_type, user_name, today, iso_time, time_str):
+    """Fallback without the RPC: GET today's row, then one POST (check-in) or PATCH (check-out)."""
+    url = f"{SUPABASE_URL}/rest/v1/attendance"
+    session = http_session()
+    columns = attendance_columns()
+    out_columns = [c for c in CHECK_OUT_COLUMNS if c in columns]
+
+    # 1. Check if already checked in today
+    select = ",".join(["id"] + out_columns)
+    get_res = session.get(f"{url}?user_id=eq.{user_id}&date=eq.{today}&select={select}", headers=supabase_headers())
+    if get_res.status_code != 200:
+        return attendance_error(get_res)
+    records = get_res.json()
+
+    if records:
+        # ALREADY CHECKED IN -> DO CHECK OUT
+        record = records[0]
+        if any(record.get(c) for c in out_columns):
+            print("Already checked out for today!")
+            return f"Already Done: {time_str}"
+
+        print(f"Checking OUT for ID: {record['id']}")
+        res = session.patch(f"{url}?id=eq.{record['id']}", headers=supabase_headers(),
+                            json={c: iso_time for c in out_columns})
+        if res.status_code in [200, 204]:
+            print(f"Check-out recorded successfully! Time: {iso_time}")
+            return f"GOODBYE {user_name}! OUT: {time_str}"
+        raise_if_unavailable(res)
+        print(f"Check-out FAILED. Error: {res.text}")
+        return "Error: Update Failed"
+
+    # NOT CHECKED IN -> DO CHECK IN
+    print("Checking IN...")
+    payload = {"user_id": user_id, "date": today}
+    if "user_type" in columns:
+        payload["user_type"] = user_type
+    if "status" in columns:
+        payload["status"] = "present"
+    payload.update({c: iso_time for c in CHECK_IN_COLUMNS if c in columns})
+    res = session.post(url, headers=supabase_headers(), json=payload)
+    if res.status_code == 201:
+        print(f"Check-in recorded successfully! Time: {iso_time}")
+        return f"WELCOME {user_name}! IN: {time_str}"
+    return attendance_error(res)
+
+# Replies that mean Supabase is down or refusing us for now, not that the scan itself is wrong
+UNAVAILABLE_STATUSES = (401, 408, 429)
+
+def raise_if_unavailable(res):
+    """Raises for outages (5xx, expired key, timeout, rate limit) so a journaled scan stays pending
+    and is retried, instead of being recorded as failed."""
+    if res.status_code >= 500 or res.status_code in UNAVAILABLE_STATUSES:
+        res.raise_for_status()
+
+def attendance_error(res):
+    raise_if_unavailable(res)
+    if "foreign key constraint" in res.text:
+        print("Error: User ID does not exist in the database.")
+        return "Error: User Not Found (Re-register)"
+    print(f"Attendance write FAILED. Error: {res.text}")
+    return "Error: Check-in Failed"
+
 if __name__ == "__main__":
     import sys
     if len(sys.argv) > 1:
@@ -398,11 +1105,74 @@ if __name__ == "__main__":
             u_type = sys.argv[4] if len(sys.argv) > 4 else "worker"
             register_face(u_id, u_name, u_type)
         elif sys.argv[1] == "verify":
-            verify_and_mark_attendance()
+            # python face_lock.py verify [camera_index|video_file|image_folder] [--headless] [--continuous]
+            args = [a for a in sys.argv[2:] if a not in ("--headless", "--continuous")]
+            source = open_frame_source(args[0]) if args else None
+            if "--continuous" in sys.argv:
+                scan_continuously(video_capture=source, headless="--headless" in sys.argv)
+            else:
+                verify_and_mark_attendance(video_capture=source, headless="--headless" in sys.argv)
+            if source is not None:
+                source.release()
+            # Give the scan a moment to reach Supabase; if it can't, the journal keeps it for next time
+            attendance_journal().flush(timeout=10)
+        elif sys.argv[1] == "recognize":
+            # python face_lock.py recognize <video_file|image_folder> [--step N] [--workers N] [--min-face PX]
+            args = sys.argv[2:]
+            step = int(args[args.index("--step") + 1]) if "--step" in args else 1
+            workers = int(args[args.index("--workers") + 1]) if "--workers" in args else None
+            min_face = int(args[args.index("--min-face") + 1]) if "--min-face" in args else None
+            for result in recognize_file(args[0], step, workers=workers, min_face=min_face):
+                print(json.dumps(result))
+        elif sys.argv[1] == "gates":
+            # python face_lock.py gates <source> [<source> ...] [--workers N]
+            args = sys.argv[2:]
+            workers = None
+            if "--workers" in args:
+                at = args.index("--workers")
+                workers = int(args[at + 1])
+                del args[at:at + 2]
+            print(scan_gates(args or [CAMERA_INDEX], workers))
+            attendance_journal().flush(timeout=10)
+        elif sys.argv[1] == "export":
+            # python face_lock.py export <from YYYY-MM-DD> [<to YYYY-MM-DD>] [--output hours.csv|hours.json]
+            #                            [--rows] [--by role]
+            args = sys.argv[2:]
+            options = {"--output": None, "--by": "user"}
+            for flag in options:
+                if flag in args:
+                    at = args.index(flag)
+                    options[flag] = args[at + 1]
+                    del args[at:at + 2]
+            output, by = options["--output"], options["--by"]
+            dates = [a for a in args if a != "--rows"]
+            start = datetime.strptime(dates[0], "%Y-%m-%d").date()
+            end = datetime.strptime(dates[1], "%Y-%m-%d").date() if len(dates) > 1 else start
+            export_attendance(start, end, output, detail="--rows" in args, by=by)
         elif sys.argv[1] == "train":
+            # Full rebuild on demand; registration only adds the new worker
+            train_model()
+        elif sys.argv[1] == "import-model":
+            import_trainer_model()
+        elif sys.argv[1] == "pack-samples":
+            # python face_lock.py pack-samples [--remove]
+            # Moves face_data/<uuid>/*.jpg into the packed store; registration and training use it from then on
+            people, samples = pack_folders(FACE_DATA_DIR, remove="--remove" in sys.argv)
+            print(f"Packed {samples} samples of {people} people into " + os.path.join(FACE_DATA_DIR, "samples.bin"))
             train_model()
+        elif sys.argv[1] == "flush":
+            # Push scans that were journaled while Supabase was unreachable
+            journal = attendance_journal()
+            journal.flush()
+            print(f"{journal.pending_count()} attendance event(s) still pending")
     else:
         print("Usage:")
         print("  Register: python face_lock.py register <id> <name> [worker|doctor|receptionist]")
-        print("  Verify:   python face_lock.py verify")
+        print("  Verify:   python face_lock.py verify [camera_index|video_file|image_folder] [--headless] [--continuous]")
+        print("  Recognize: python face_lock.py recognize <video_file|image_folder> [--step N] [--workers N] [--min-face PX]")
+        print("  Gates:    python face_lock.py gates <camera_index|video_file|image_folder> ... [--workers N]")
         print("  Train:    python face_lock.py train")
+        print("  Export:   python face_lock.py export <from> [<to>] [--output hours.csv|hours.json] [--rows] [--by role]")
+        print("  Import:   python face_lock.py import-model   (trainer.yml -> model.bin)")
+        print("  Pack:     python face_lock.py pack-samples [--remove]   (face_data/<uuid>/*.jpg -> samples.bin)")
+        print("  Flush:    python face_lock.py flush   (sync journaled attendance to Supabase)")
@@ -0,0 +1,189 @@
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Scanner instrumentation, published by bridge_service.py on /metrics in Prometheus text format.
+# FACE_METRICS=0 turns it off: recording calls return immediately and timed_stage() leaves functions untouched.
+ENABLED = os.environ.get("FACE_METRICS", "1") != "0"
+# When this process started (roughly: when the first scanner module was imported)
+PROCESS_START = time.time()
+
+# Latency buckets in seconds, from a fast predict() up to a slow network round trip
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per combination of label values, e.g. FRAMES.inc("dropped")."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *label_values, amount=1):
+        if not ENABLED:
+            return
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return [f"{self.name}{_format_labels(self.labels, values)} {_format_value(v)}" for values, v in items]
+
+
+class Histogram:
+    """Latency distribution per combination of label values. time() is a context manager."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.values = {}  # label values -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, seconds, *label_values):
+        if not ENABLED:
+            return
+        index = bisect_left(self.buckets, seconds)
+        with self.lock:
+            state = self.values.get(label_values)
+            if state is None:
+                state = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[index] += 1
+            state[-2] += seconds
+            state[-1] += 1
+
+    def time(self, *label_values):
+        return _Timer(self, label_values) if ENABLED else _NULL_TIMER
+
+    def render(self):
+        with self.lock:
+            items = sorted((values, list(state)) for values, state in self.values.items())
+        lines = []
+        for values, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), state):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, values, [('le', _format_value(bound))])} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, values)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, values)} {state[-1]}")
+        return lines
+
+
+class Gauge:
+    """A value read at scrape time from read() (e.g. a queue length)."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+        _registry.append(self)
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception:
+            return []
+        return [] if value is None else [f"{self.name} {_format_value(value)}"]
+
+
+class _Timer:
+    __slots__ = ("histogram", "label_values", "start")
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed_stage(stage):
+    """Decorator recording each call's duration in STAGE_SECONDS. A no-op when metrics are off."""
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        def wrapper(*args, **kwargs):
+            with STAGE_SECONDS.time(stage):
+                return fn(*args, **kwargs)
+        wrapper.__name__, wrapper.__doc__, wrapper.__wrapped__ = fn.__name__, fn.__doc__, fn
+        return wrapper
+    return decorate
+
+
+def render():
+    """All metrics in Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in _registry:
+        samples = metric.render()
+        if not samples:
+            continue
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = Histogram("hms_stage_duration_seconds",
+                          "Time spent per scanner stage (startup, model_load, camera_open, detect, recognize, ...)",
+                          ("stage",))
+FRAMES = Counter("hms_frames_total", "Camera frames by outcome: processed by recognition or dropped as stale",
+                 ("result",))
+GATE_FRAMES = Counter("hms_gate_frames_total", "Frames per camera of the multi-gate scanner by outcome",
+                      ("gate", "result"))
+RECOGNITIONS = Counter("hms_recognitions_total", "Recognized faces by outcome: match or no_match", ("result",))
+HTTP_SECONDS = Histogram("hms_supabase_request_duration_seconds", "Supabase request latency (time to response headers)",
+                         ("method", "endpoint"))
+HTTP_REQUESTS = Counter("hms_supabase_requests_total", "Supabase requests by endpoint and HTTP status",
+                        ("method", "endpoint", "status"))
+SYNC_RETRIES = Counter("hms_attendance_sync_retries_total",
+                       "Failed attendance journal flushes that were scheduled for retry")
+JOBS = Counter("hms_jobs_total", "Bridge jobs by kind and final state", ("kind", "state"))
+Gauge("hms_process_start_time_seconds", "Start time of the process since the Unix epoch", lambda: PROCESS_START)
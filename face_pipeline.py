@@ -0,0 +1,338 @@
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+import cv2
+
+from face_metrics import FRAMES, STAGE_SECONDS
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+# Marks the end of a finite source (video file / image folder) as it flows through the stages
+END_OF_STREAM = object()
+
+# Worker pools that currently keep OpenCV single-threaded, and the thread count to restore after the last
+_single_threaded = [0, None]
+_single_threaded_lock = threading.Lock()
+
+
+class CaptureSource:
+    """Wraps cv2.VideoCapture for a webcam index or a video file.
+    Webcams are 'live' (stale frames get dropped); files are replayed frame by frame."""
+
+    def __init__(self, source, live):
+        self.capture = cv2.VideoCapture(source)
+        self.live = live
+
+    def read(self):
+        return self.capture.read()
+
+    def grab(self):
+        return self.capture.grab()
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def release(self):
+        self.capture.release()
+
+
+class ImageFolderSource:
+    """Serves the images of a directory in name order with the VideoCapture read() interface.
+    Lets the scanner run headless and reproducibly without a camera."""
+
+    live = False
+
+    def __init__(self, folder):
+        self.paths = [os.path.join(folder, f) for f in sorted(os.listdir(folder))
+                      if f.lower().endswith(IMAGE_EXTENSIONS)]
+        self.position = 0
+
+    def read(self):
+        while self.position < len(self.paths):
+            frame = cv2.imread(self.paths[self.position])
+            self.position += 1
+            if frame is not None:
+                return True, frame
+        return False, None
+
+    def grab(self):
+        return self.read()[0]
+
+    def isOpened(self):
+        return self.position < len(self.paths)
+
+    def release(self):
+        self.position = len(self.paths)
+
+
+def open_frame_source(source):
+    """Opens a webcam index (int or digit string), a video file or a directory of images."""
+    if isinstance(source, int) or str(source).isdigit():
+        return CaptureSource(int(source), live=True)
+    if os.path.isdir(source):
+        return ImageFolderSource(source)
+    if os.path.isfile(source):
+        return CaptureSource(source, live=False)
+    raise ValueError(f"Frame source not found: {source}")
+
+
+# Smallest face (pixels wide) the scanners look for. 0 finds every face the cascade can, which means
+# full scans at full resolution; e.g. FACE_MIN_FACE_WIDTH=80 for a camera people walk right up to
+# lets them run on a downscaled frame.
+MIN_FACE_WIDTH = int(os.environ.get("FACE_MIN_FACE_WIDTH", "0"))
+# Full scans shrink the frame only until the smallest face to find is this wide. The cascade's window
+# is 24 px, but it starts missing faces well before they get that small.
+DETECT_FACE_WIDTH = 48
+# A tracked face is re-detected at roughly this width inside its region of interest
+TRACK_FACE_WIDTH = 96
+# Frames between forced full-frame scans while tracking (picks up people walking in)
+FULL_SCAN_INTERVAL = 10
+
+
+class FaceDetector:
+    """Haar cascade detection that avoids full-resolution scans where it can.
+
+    With a minimum face size (min_size, or FACE_MIN_FACE_WIDTH), full scans run on a copy downscaled
+    so that size becomes DETECT_FACE_WIDTH, and boxes are mapped back to full resolution; without one
+    they run at full resolution so no face the cascade can find is lost.
+    Between full scans, each face found on the previous frame is searched for only in a small region
+    around its last position. A full scan happens every FULL_SCAN_INTERVAL frames, or as soon as a
+    tracked face is lost. Keep one instance per stream so the tracking state carries across frames.
+    """
+
+    def __init__(self, cascade, scale_factor=1.2, min_neighbors=5, min_size=None,
+                 full_scan_interval=FULL_SCAN_INTERVAL, roi_margin=0.5):
+        self.cascade = cascade
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        if min_size is None and MIN_FACE_WIDTH:
+            min_size = (MIN_FACE_WIDTH, MIN_FACE_WIDTH)
+        # Full-resolution (w, h); smaller faces are ignored. (0, 0) means no minimum, whatever the environment says
+        self.min_size = min_size if min_size and min_size[0] else None
+        self.full_scan_interval = full_scan_interval
+        self.roi_margin = roi_margin
+        self.tracks = []
+        self.frames_since_full_scan = 0
+
+    def __call__(self, gray):
+        faces = None
+        if self.tracks and self.frames_since_full_scan < self.full_scan_interval:
+            faces = self._track(gray)
+        if faces is None:
+            faces = self._full_scan(gray)
+            self.frames_since_full_scan = 0
+        else:
+            self.frames_since_full_scan += 1
+        self.tracks = faces
+        return faces
+
+    def reset(self):
+        self.tracks = []
+
+    def _detect(self, image, scale, min_size=None, max_size=None):
+        """Runs the cascade on an image shrunk by `scale` and returns boxes in the original coordinates."""
+        if scale < 1.0:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        kwargs = {}
+        if min_size:
+            kwargs["minSize"] = (max(1, int(min_size[0] * scale)), max(1, int(min_size[1] * scale)))
+        if max_size:
+            kwargs["maxSize"] = (int(max_size[0] * scale), int(max_size[1] * scale))
+        boxes = self.cascade.detectMultiScale(image, self.scale_factor, self.min_neighbors, **kwargs)
+        return [tuple(int(round(v / scale)) for v in box) for box in boxes]
+
+    def _full_scan(self, gray):
+        scale = min(1.0, DETECT_FACE_WIDTH / self.min_size[0]) if self.min_size else 1.0
+        return self._detect(gray, scale, self.min_size)
+
+    def _track(self, gray):
+        """Re-detects each tracked face in a region around its last box. Returns None when one is lost."""
+        height, width = gray.shape[:2]
+        faces = []
+        for (x, y, w, h) in self.tracks:
+            mx, my = int(w * self.roi_margin), int(h * self.roi_margin)
+            x0, y0 = max(0, x - mx), max(0, y - my)
+            x1, y1 = min(width, x + w + mx), min(height, y + h + my)
+            # Only look for faces of about the tracked size
+            min_size = (int(w * 0.6), int(h * 0.6))
+            if self.min_size:
+                min_size = (max(min_size[0], self.min_size[0]), max(min_size[1], self.min_size[1]))
+            found = self._detect(gray[y0:y1, x0:x1], min(1.0, TRACK_FACE_WIDTH / w), min_size, (x1 - x0, y1 - y0))
+            if not found:
+                return None
+            fx, fy, fw, fh = max(found, key=lambda b: b[2] * b[3])
+            faces.append((x0 + fx, y0 + fy, fw, fh))
+        return faces
+
+
+class RecognizedFrame:
+    """One frame that went through detection and recognition."""
+
+    def __init__(self, index, frame, gray, faces):
+        self.index = index
+        self.frame = frame
+        self.gray = gray
+        self.faces = faces  # list of (x, y, w, h)
+        self.matches = []   # list of ((x, y, w, h), label, distance)
+
+
+def detect_frame(detector, index, frame):
+    """A RecognizedFrame with the faces detector finds in a BGR frame, not yet recognized."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    with STAGE_SECONDS.time("detect"):
+        faces = detector(gray)
+    return RecognizedFrame(index, frame, gray, faces)
+
+
+def recognize_frame(recognize, result):
+    """Fills in result.matches and counts the frame as processed. Returns result."""
+    if len(result.faces):
+        with STAGE_SECONDS.time("recognize"):
+            result.matches = recognize(result.gray, result.faces)
+    FRAMES.inc("processed")
+    return result
+
+
+def process_frame(detector, recognize, index, frame):
+    """Detection and recognition of one frame on the calling thread, for pools of worker threads
+    (face_batch, face_gates). OpenCV and NumPy release the GIL while they work, so the workers use
+    separate cores. Each worker needs its own detector (CascadeClassifier isn't safe to share
+    between threads); recognize(gray, faces) is shared by all of them and must be read-only, as
+    GalleryMatcher is. Run the pool inside single_threaded_opencv()."""
+    return recognize_frame(recognize, detect_frame(detector, index, frame))
+
+
+@contextmanager
+def single_threaded_opencv():
+    """Turns off OpenCV's own thread pool while any worker pool is inside: parallelism comes from
+    the workers, and OpenCV's threads on top would oversubscribe the cores. setNumThreads() is global."""
+    with _single_threaded_lock:
+        if not _single_threaded[0]:
+            _single_threaded[1] = cv2.getNumThreads()
+            cv2.setNumThreads(1)
+        _single_threaded[0] += 1
+    try:
+        yield
+    finally:
+        with _single_threaded_lock:
+            _single_threaded[0] -= 1
+            if not _single_threaded[0]:
+                cv2.setNumThreads(_single_threaded[1])
+
+
+class FramePipeline:
+    """Runs capture -> detect -> recognize on their own threads, connected by bounded queues.
+
+    For live sources each queue holds only the newest item: when a stage falls behind the older
+    frame is dropped, so detection always works on the latest frame and the camera buffer never
+    piles up. Finite sources (files, folders) apply back-pressure instead, so every frame is processed.
+
+    detect(gray) returns face boxes; recognize(gray, faces) returns [(box, label, distance)].
+    """
+
+    def __init__(self, source, detect, recognize, queue_size=1):
+        self.source = source
+        self.detect = detect
+        self.recognize = recognize
+        self.live = getattr(source, "live", True)
+        self.detect_queue = queue.Queue(maxsize=queue_size)
+        self.recognize_queue = queue.Queue(maxsize=queue_size)
+        self.results = queue.Queue(maxsize=queue_size if self.live else 0)
+        self.stopped = threading.Event()
+        self.preview_lock = threading.Lock()
+        self.preview = None
+        self.last_result = None
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.threads = [
+            threading.Thread(target=self._capture_loop, name="pipeline-capture", daemon=True),
+            threading.Thread(target=self._detect_loop, name="pipeline-detect", daemon=True),
+            threading.Thread(target=self._recognize_loop, name="pipeline-recognize", daemon=True),
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join(timeout=1)
+
+    def latest_frame(self):
+        """Newest captured frame, for a preview that never waits on detection."""
+        with self.preview_lock:
+            return self.preview
+
+    def next_result(self, timeout=None):
+        """Returns the next RecognizedFrame, END_OF_STREAM, or None if nothing arrived within timeout."""
+        try:
+            if timeout == 0:
+                return self.results.get_nowait()
+            return self.results.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _put(self, q, item):
+        if item is END_OF_STREAM or not self.live:
+            while not self.stopped.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+            return
+        while True:
+            try:
+                q.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    q.get_nowait()
+                    self.frames_dropped += 1
+                    FRAMES.inc("dropped")
+                except queue.Empty:
+                    pass
+
+    def _get(self, q):
+        while not self.stopped.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return END_OF_STREAM
+
+    def _capture_loop(self):
+        index = 0
+        while not self.stopped.is_set():
+            ret, frame = self.source.read()
+            if not ret:
+                break
+            with self.preview_lock:
+                self.preview = frame
+            self.frames_captured += 1
+            self._put(self.detect_queue, (index, frame))
+            index += 1
+        self._put(self.detect_queue, END_OF_STREAM)
+
+    def _detect_loop(self):
+        while True:
+            item = self._get(self.detect_queue)
+            if item is END_OF_STREAM:
+                break
+            index, frame = item
+            self._put(self.recognize_queue, detect_frame(self.detect, index, frame))
+        self._put(self.recognize_queue, END_OF_STREAM)
+
+    def _recognize_loop(self):
+        while True:
+            result = self._get(self.recognize_queue)
+            if result is END_OF_STREAM:
+                break
+            recognize_frame(self.recognize, result)
+            self.last_result = result
+            self._put(self.results, result)
+        self._put(self.results, END_OF_STREAM)
@@ -0,0 +1,124 @@
+import glob
+import os
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+# Face crops kept per person
+SAMPLES_PER_PERSON = 20
+# Capture runs at least this long (to see several head poses) and stops by the maximum even if
+# the pool is still empty (registration then fails with no usable samples)
+MIN_CAPTURE_SECONDS = 3
+MAX_CAPTURE_SECONDS = 10
+# Candidates kept while capturing; the best SAMPLES_PER_PERSON of them are saved
+POOL_SIZE = 3 * SAMPLES_PER_PERSON
+# Crops blurrier than this (Laplacian variance at QUALITY_SIZE) are never kept
+MIN_SHARPNESS = 20.0
+# Two crops whose mean-removed thumbnails differ by less than this (grey levels) count as the same pose
+DUPLICATE_DISTANCE = 4.0
+QUALITY_SIZE = 128
+THUMB_SIZE = 16
+# Faces this wide or wider get the full size score
+FULL_SIZE_WIDTH = 160
+
+
+def sample_quality(crop):
+    """Cheap quality score of a grayscale face crop: sharpness (variance of the Laplacian) scaled down
+    for small and for badly lit faces. Returns 0 for crops too blurry to keep."""
+    small = cv2.resize(crop, (QUALITY_SIZE, QUALITY_SIZE), interpolation=cv2.INTER_AREA)
+    sharpness = cv2.Laplacian(small, cv2.CV_64F).var()
+    if sharpness < MIN_SHARPNESS:
+        return 0.0
+    size_factor = min(1.0, crop.shape[1] / FULL_SIZE_WIDTH)
+    brightness_factor = 1.0 - min(0.7, abs(float(small.mean()) - 128.0) / 160.0)
+    return sharpness * size_factor * brightness_factor
+
+
+def _thumbnail(crop):
+    thumb = cv2.resize(crop, (THUMB_SIZE, THUMB_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    return thumb - thumb.mean()
+
+
+class SamplePool:
+    """Rolling pool of the best-scoring, mutually different face crops seen so far.
+
+    A new crop that looks like one already in the pool (same pose) replaces it only if it scores
+    higher, so a person standing still fills one slot instead of thirty. When the pool is full the
+    lowest-scoring candidate is dropped.
+    """
+
+    def __init__(self, target=SAMPLES_PER_PERSON, capacity=POOL_SIZE):
+        self.target = target
+        self.capacity = capacity
+        self.candidates = []  # [score, crop, thumbnail]
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def is_full(self):
+        return len(self.candidates) >= self.target
+
+    def offer(self, crop):
+        """Scores a crop and keeps it if it is good enough. Returns True if it was kept."""
+        score = sample_quality(crop)
+        if score <= 0:
+            return False
+        thumb = _thumbnail(crop)
+        if self.candidates:
+            distances = [np.abs(c[2] - thumb).mean() for c in self.candidates]
+            nearest = int(np.argmin(distances))
+            if distances[nearest] < DUPLICATE_DISTANCE:
+                if score <= self.candidates[nearest][0]:
+                    return False
+                self.candidates[nearest] = [score, crop.copy(), thumb]
+                return True
+        self.candidates.append([score, crop.copy(), thumb])
+        if len(self.candidates) > self.capacity:
+            self.candidates.remove(min(self.candidates, key=lambda c: c[0]))
+        return True
+
+    def best(self):
+        """The top `target` crops by score."""
+        ranked = sorted(self.candidates, key=lambda c: c[0], reverse=True)
+        return [crop for _, crop, _ in ranked[:self.target]]
+
+
+class SampleWriter:
+    """Writes image files on a background thread so the capture loop never waits on the disk."""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.errors = []
+        self.thread = threading.Thread(target=self._run, name="sample-writer", daemon=True)
+        self.thread.start()
+
+    def save(self, path, image):
+        self.queue.put((path, image))
+
+    def close(self):
+        """Waits for every queued write. Returns the number of failed writes."""
+        self.queue.put(None)
+        self.thread.join()
+        return len(self.errors)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            path, image = item
+            if not cv2.imwrite(path, image):
+                self.errors.append(path)
+
+
+def save_samples(worker_path, crops):
+    """Replaces a worker folder's face images with crops (1.jpg, 2.jpg, ...) through a SampleWriter.
+    Returns the writer; close() it before reading the folder back."""
+    for old_path in glob.glob(os.path.join(worker_path, "*.jpg")):
+        os.remove(old_path)
+    writer = SampleWriter()
+    for number, crop in enumerate(crops, 1):
+        writer.save(os.path.join(worker_path, f"{number}.jpg"), crop)
+    return writer
@@ -0,0 +1,221 @@
+import json
+import os
+import struct
+
+import cv2
+import numpy as np
+
+# Packed face samples. Every crop is resized to SAMPLE_SIZE x SAMPLE_SIZE and stored as raw uint8 rows,
+# one after another, in samples.bin (a 64-byte header, then row i at 64 + i * SAMPLE_SIZE^2).
+# samples.json holds the index: per person their metadata and [[first_row, count], ...], plus the
+# total row count. Rows are only ever appended; re-registering points the person at new rows and
+# leaves the old ones behind until compact(). Training reads the whole file in one sequential pass
+# instead of listing, opening and decoding thousands of JPEGs.
+STORE_FILE = "samples.bin"
+STORE_INDEX = "samples.json"
+# LBP histograms of the rows (float32, row i = sample i), kept up to date by face_features
+FEATURES_FILE = "samples_features.bin"
+
+SAMPLE_SIZE = 128
+STORE_MAGIC = b"HMSSAMPL"
+STORE_VERSION = 1
+HEADER_SIZE = 64
+HEADER = struct.Struct("<8sIII")  # magic, version, height, width
+
+
+def normalize_crop(crop, size=SAMPLE_SIZE):
+    """A grayscale face crop resized to size x size uint8."""
+    if crop.ndim == 3:
+        crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    interpolation = cv2.INTER_AREA if crop.shape[0] > size else cv2.INTER_LINEAR
+    return np.ascontiguousarray(cv2.resize(crop, (size, size), interpolation=interpolation), dtype=np.uint8)
+
+
+class SampleStore:
+    """The packed samples of one face_data directory. Open with SampleStore(directory) once
+    SampleStore.exists(directory), or make a new one with SampleStore.create(directory)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, STORE_FILE)
+        self.index_path = os.path.join(directory, STORE_INDEX)
+        self.features_path = os.path.join(directory, FEATURES_FILE)
+        with open(self.index_path, "r") as f:
+            index = json.load(f)
+        if index.get("version") != STORE_VERSION:
+            raise ValueError(f"{self.index_path} has sample store version {index.get('version')}, "
+                             f"expected {STORE_VERSION}")
+        self.size = index["size"]
+        self.records = index["records"]
+        self.users = index["users"]        # uuid -> {"name", "type", "id", "rows": [[first, count], ...]}
+        self.features = index.get("features")  # {"params": {...}, "rows": n} for FEATURES_FILE
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, STORE_INDEX))
+
+    @classmethod
+    def create(cls, directory, size=SAMPLE_SIZE):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, STORE_FILE), "wb") as f:
+            f.write(HEADER.pack(STORE_MAGIC, STORE_VERSION, size, size).ljust(HEADER_SIZE, b"\0"))
+        _write_index(os.path.join(directory, STORE_INDEX),
+                     {"version": STORE_VERSION, "size": size, "records": 0, "users": {}})
+        return cls(directory)
+
+    @property
+    def row_bytes(self):
+        return self.size * self.size
+
+    def save_index(self):
+        _write_index(self.index_path, {"version": STORE_VERSION, "size": self.size, "records": self.records,
+                                       "users": self.users, "features": self.features})
+
+    # --- Reading --------------------------------------------------------------
+
+    def user_ids(self):
+        """Everyone in the store, in the order they were (last) stored."""
+        return sorted(self.users, key=lambda user_id: self.users[user_id]["rows"][0][0]
+                      if self.users[user_id]["rows"] else -1)
+
+    def meta(self, user_id):
+        return {k: v for k, v in self.users[user_id].items() if k != "rows"}
+
+    def segments(self, user_id):
+        """[(first_row, count), ...] of a person's samples; usually a single run."""
+        return [tuple(segment) for segment in self.users.get(user_id, {}).get("rows", [])]
+
+    def count(self, user_id):
+        return sum(count for _, count in self.segments(user_id))
+
+    def garbage(self):
+        """Rows no longer referenced by anyone (left behind by re-registration or remove())."""
+        return self.records - sum(self.count(user_id) for user_id in self.users)
+
+    def array(self):
+        """All rows as a read-only (records x size x size) memory map."""
+        if not self.records:
+            return np.zeros((0, self.size, self.size), dtype=np.uint8)
+        return np.memmap(self.path, dtype=np.uint8, mode="r", offset=HEADER_SIZE,
+                         shape=(self.records, self.size, self.size))
+
+    def samples(self, user_id):
+        """A person's crops as a (count x size x size) array."""
+        rows = self.array()
+        return np.concatenate([rows[first:first + count] for first, count in self.segments(user_id)] or
+                              [np.zeros((0, self.size, self.size), dtype=np.uint8)])
+
+    # --- Writing --------------------------------------------------------------
+
+    def put(self, user_id, crops, meta):
+        """Stores a person's crops, replacing any they had. Returns the number stored."""
+        return self.put_many([(user_id, crops, meta)])
+
+    def put_many(self, people):
+        """put() for an iterable of (user_id, crops, meta), appending all rows and writing the index once."""
+        stored = 0
+        with open(self.path, "r+b") as f:
+            valid_end = HEADER_SIZE + self.records * self.row_bytes
+            f.seek(0, os.SEEK_END)
+            if f.tell() != valid_end:
+                f.truncate(valid_end)  # drop rows of an append the index never recorded
+            f.seek(valid_end)
+            for user_id, crops, meta in people:
+                count = 0
+                for crop in crops:
+                    f.write(normalize_crop(crop, self.size).tobytes())
+                    count += 1
+                entry = {k: v for k, v in meta.items() if k != "rows"}
+                entry["rows"] = [[self.records, count]] if count else []
+                self.users[str(user_id)] = entry
+                self.records += count
+                stored += count
+            f.flush()
+            os.fsync(f.fileno())
+        self.save_index()
+        return stored
+
+    def remove(self, user_id):
+        if self.users.pop(str(user_id), None) is not None:
+            self.save_index()
+
+    def compact(self):
+        """Rewrites the store (and its features, if current) without unreferenced rows.
+        Nobody may hold a mapping of the files meanwhile; Windows refuses to replace mapped files."""
+        keep = [(user_id, first, count) for user_id in self.user_ids() for first, count in self.segments(user_id)]
+        features_rows = self.features["rows"] if self.features else 0
+        keep_features = bool(self.features) and all(first + count <= features_rows for _, first, count in keep)
+        rows = self.array()
+        with open(self.path + ".tmp", "wb") as f:
+            f.write(HEADER.pack(STORE_MAGIC, STORE_VERSION, self.size, self.size).ljust(HEADER_SIZE, b"\0"))
+            for _, first, count in keep:
+                f.write(rows[first:first + count].tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        del rows
+        if keep_features:
+            histograms = np.memmap(self.features_path, dtype=np.float32, mode="r").reshape(features_rows, -1)
+            with open(self.features_path + ".tmp", "wb") as f:
+                for _, first, count in keep:
+                    f.write(histograms[first:first + count].tobytes())
+            del histograms
+        position, users = 0, {}
+        for user_id, first, count in keep:
+            users.setdefault(user_id, dict(self.meta(user_id), rows=[]))["rows"].append([position, count])
+            position += count
+        for user_id in self.users:
+            users.setdefault(user_id, dict(self.meta(user_id), rows=[]))
+        # Swap the index last: until then the old index still matches the old files
+        os.replace(self.path + ".tmp", self.path)
+        if keep_features:
+            os.replace(self.features_path + ".tmp", self.features_path)
+            self.features = dict(self.features, rows=position)
+        else:
+            self.features = None
+        dropped = self.records - position
+        self.users, self.records = users, position
+        self.save_index()
+        return dropped
+
+
+def _write_index(path, index):
+    with open(path + ".tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(path + ".tmp", path)
+
+
+def pack_folders(face_data_dir, remove=False):
+    """Migrates the face_data/<uuid>/*.jpg + meta.json layout into the packed store (created if
+    needed). People already in the store are replaced by their folder's images. With remove=True the
+    JPEGs, feature caches and meta.json are deleted afterwards and empty folders removed.
+    Returns (people, samples) packed."""
+    store = SampleStore(face_data_dir) if SampleStore.exists(face_data_dir) else SampleStore.create(face_data_dir)
+    folders = sorted(f for f in os.listdir(face_data_dir) if os.path.isdir(os.path.join(face_data_dir, f)))
+    packed = []
+
+    def people():
+        for folder in folders:
+            worker_path = os.path.join(face_data_dir, folder)
+            names = sorted((f for f in os.listdir(worker_path) if f.endswith(".jpg")),
+                           key=lambda f: (len(f), f))  # 1.jpg, 2.jpg, ..., 10.jpg
+            crops = [img for img in (cv2.imread(os.path.join(worker_path, name), cv2.IMREAD_GRAYSCALE)
+                                     for name in names) if img is not None]
+            if not crops:
+                continue
+            meta = {"name": "Unknown", "type": "worker", "id": folder}
+            meta_path = os.path.join(worker_path, "meta.json")
+            if os.path.exists(meta_path):
+                with open(meta_path, "r") as f:
+                    meta.update(json.load(f))
+            packed.append(worker_path)
+            yield folder, crops, meta
+
+    samples = store.put_many(people())
+    if remove:
+        for worker_path in packed:
+            for name in os.listdir(worker_path):
+                if name.endswith(".jpg") or name in ("meta.json", "features.npy", "features.json"):
+                    os.remove(os.path.join(worker_path, name))
+            if not os.listdir(worker_path):
+                os.rmdir(worker_path)
+    return len(packed), samples
@@ -0,0 +1,222 @@
+import http.server
+import json
+import threading
+import time
+import urllib.parse
+import uuid
+from datetime import datetime, timezone
+
+# attendance as created by database/Rebuild_Schema_v2.sql plus user_type from Attendance_Scan_RPC.sql
+ATTENDANCE_COLUMNS = ("id", "user_id", "user_type", "check_in", "check_out", "status", "date", "created_at")
+FILTER_OPS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "gt": lambda a, b: a is not None and a > b,
+    "gte": lambda a, b: a is not None and a >= b,
+    "lt": lambda a, b: a is not None and a < b,
+    "lte": lambda a, b: a is not None and a <= b,
+}
+
+
+class PostgrestStub:
+    """In-memory stand-in for the parts of Supabase's REST API the scanner talks to: select / insert /
+    update on the attendance table (eq/gt/gte/lt/lte filters, order, limit, offset, Range) and the
+    mark_attendance / mark_attendance_batch RPCs. For benchmarks and offline runs, not a database.
+
+    rpc=False answers the RPCs with 404 like a project without Attendance_Scan_RPC.sql;
+    latency adds a fixed delay to every request to imitate a network round trip.
+    """
+
+    def __init__(self, rpc=True, latency=0.0, columns=ATTENDANCE_COLUMNS, port=0):
+        self.rpc = rpc
+        self.latency = latency
+        self.columns = set(columns)
+        self.attendance = []
+        self.scan_events = {}  # event_key -> action
+        self.requests = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(_Handler):
+            pass
+        Handler.stub = stub
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="postgrest-stub", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- Table access (called with self.lock held) ----------------------------
+
+    def select(self, params, range_header=None):
+        rows = [r for r in self.attendance if _matches(r, params)]
+        for spec in reversed(params.get("order", "").split(",") if params.get("order") else []):
+            column, _, direction = spec.partition(".")
+            rows.sort(key=lambda r: (r.get(column) is None, r.get(column) or ""), reverse=direction.startswith("desc"))
+        offset = int(params.get("offset", 0))
+        limit = int(params["limit"]) if "limit" in params else None
+        if range_header:
+            first, _, last = range_header.partition("-")
+            offset = int(first)
+            limit = int(last) - offset + 1 if last else None
+        rows = rows[offset:] if limit is None else rows[offset:offset + limit]
+        select = params.get("select", "*")
+        if select != "*":
+            rows = [{c: r.get(c) for c in select.split(",")} for r in rows]
+        return rows, offset
+
+    def insert(self, row):
+        full = dict.fromkeys(self.columns)
+        full.update(row)
+        full["id"] = row.get("id") or str(uuid.uuid4())
+        full["created_at"] = row.get("created_at") or datetime.now(timezone.utc).isoformat()
+        if "date" in self.columns and not full.get("date"):
+            full["date"] = datetime.now().date().isoformat()
+        self.attendance.append(full)
+        return full
+
+    def mark_attendance(self, user_id, user_type, date, ts):
+        """Same rules as public.mark_attendance() in database/Attendance_Scan_RPC.sql."""
+        rows = [r for r in self.attendance if r["user_id"] == user_id and r["date"] == date]
+        if not rows:
+            rec = self.insert({"user_id": user_id, "user_type": user_type, "date": date,
+                               "status": "present", "check_in": ts})
+            action = "check_in"
+        elif rows[0].get("check_out"):
+            rec, action = rows[0], "already_done"
+        else:
+            rec, action = rows[0], "check_out"
+            rec["check_out"] = ts
+        return {"action": action, "id": rec["id"], "check_in": rec["check_in"], "check_out": rec.get("check_out")}
+
+    def mark_attendance_batch(self, events):
+        results = []
+        for event in events:
+            key = event["event_key"]
+            if key in self.scan_events:
+                results.append({"event_key": key, "action": self.scan_events[key], "duplicate": True})
+                continue
+            action = self.mark_attendance(event["user_id"], event.get("user_type"), event["date"], event["ts"])["action"]
+            self.scan_events[key] = action
+            results.append({"event_key": key, "action": action})
+        return results
+
+
+def _matches(row, params):
+    for column, condition in params.items():
+        if column in ("select", "order", "limit", "offset"):
+            continue
+        op, _, value = condition.partition(".")
+        if op not in FILTER_OPS or not FILTER_OPS[op](row.get(column), value):
+            return False
+    return True
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send headers and body in one segment; separate small writes stall on delayed ACKs
+    wbufsize = 64 * 1024
+    stub = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, code, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self):
+        """Returns (table or rpc name, params) for /rest/v1/... paths, after the simulated latency."""
+        self.stub.requests += 1
+        if self.stub.latency:
+            time.sleep(self.stub.latency)
+        parsed = urllib.parse.urlparse(self.path)
+        params = {k: v[-1] for k, v in urllib.parse.parse_qs(parsed.query, keep_blank_values=True).items()}
+        return parsed.path.replace("/rest/v1/", "", 1), params
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def unknown_columns(self, columns):
+        return [c for c in columns if c != "*" and c not in self.stub.columns]
+
+    def do_GET(self):
+        name, params = self.route()
+        if name != "attendance":
+            return self.send_json(404, {"code": "42P01", "message": f"relation {name} does not exist"})
+        missing = self.unknown_columns(params.get("select", "*").split(",") + [
+            c for c in params if c not in ("select", "order", "limit", "offset")])
+        if missing:
+            return self.send_json(400, {"code": "42703", "message": f"column attendance.{missing[0]} does not exist"})
+        with self.stub.lock:
+            rows, offset = self.stub.select(params, self.headers.get("Range"))
+        self.send_json(200, rows, {"Content-Range": f"{offset}-{offset + len(rows) - 1}/*" if rows else "*/*"})
+
+    def do_POST(self):
+        name, _ = self.route()
+        body = self.read_body()
+        if name.startswith("rpc/"):
+            if not self.stub.rpc or name not in ("rpc/mark_attendance", "rpc/mark_attendance_batch"):
+                return self.send_json(404, {"code": "PGRST202", "message": f"Could not find the function {name[4:]}"})
+            with self.stub.lock:
+                if name == "rpc/mark_attendance":
+                    result = self.stub.mark_attendance(body["p_user_id"], body.get("p_user_type"),
+                                                       body["p_date"], body["p_time"])
+                else:
+                    result = self.stub.mark_attendance_batch(body["p_events"])
+            return self.send_json(200, result)
+        if name != "attendance":
+            return self.send_json(404, {"code": "42P01", "message": f"relation {name} does not exist"})
+        rows = body if isinstance(body, list) else [body]
+        missing = self.unknown_columns({c for row in rows for c in row})
+        if missing:
+            return self.send_json(400, {"code": "PGRST204", "message": f"Could not find the '{missing[0]}' column"})
+        with self.stub.lock:
+            created = [self.stub.insert(row) for row in rows]
+        self.send_json(201, created)
+
+    def do_PATCH(self):
+        name, params = self.route()
+        body = self.read_body()
+        if name != "attendance":
+            return self.send_json(404, {"code": "42P01", "message": f"relation {name} does not exist"})
+        missing = self.unknown_columns(body)
+        if missing:
+            return self.send_json(400, {"code": "PGRST204", "message": f"Could not find the '{missing[0]}' column"})
+        with self.stub.lock:
+            rows = [r for r in self.stub.attendance if _matches(r, params)]
+            for row in rows:
+                row.update(body)
+        self.send_json(200, rows)
+
+
+if __name__ == "__main__":
+    # python postgrest_stub.py [port] [--no-rpc]  then point VITE_SUPABASE_URL at http://127.0.0.1:<port>
+    import sys
+    args = [a for a in sys.argv[1:] if a != "--no-rpc"]
+    stub = PostgrestStub(rpc="--no-rpc" not in sys.argv, port=int(args[0]) if args else 54321)
+    print(f"PostgREST stub listening on {stub.url}")
+    stub.server.serve_forever()